@@ -0,0 +1,165 @@
+"""
+Compares summarizer configurations on the same papers, for latency and for agreement with a reference.
+
+Run from the backend directory:
+
+    python -m benchmarks.compare_summarizers --pdfs ./papers \
+        --configs fp32:beam4,int8:beam4,int8:greedy,sshleifer/distilbart-cnn-12-6@int8:greedy
+
+A configuration is `[checkpoint@]backend:decoding`; the checkpoint defaults to SUMMARIZER_MODEL_NAME.
+The first configuration is the reference the others are scored against with ROUGE-1 and ROUGE-L F1.
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+from itertools import islice
+
+from pdf_extraction import extract_pdf
+from summarizer import DECODING_PRESETS, SUMMARIZER_MODEL_NAME, SUMMARY_INPUT_CHAR_BUDGET, SUMMARY_MAX_SECTIONS, \
+    build_summarizer_model, build_summarizer_tokenizer, generate_summaries, iter_token_sections
+
+
+def parse_config(config):
+    checkpoint, _, rest = config.rpartition("@")
+    backend, _, decoding = rest.partition(":")
+    return checkpoint or SUMMARIZER_MODEL_NAME, backend, decoding or "beam4"
+
+
+def load_documents(pdf_dir=None, text_dir=None, limit=None):
+    documents = []
+    for directory, suffix in ((pdf_dir, ".pdf"), (text_dir, ".txt")):
+        if not directory:
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(directory, name)
+            if suffix == ".pdf":
+                with open(path, "rb") as pdf_file:
+                    text = extract_pdf(pdf_file.read(), max_text_chars=SUMMARY_INPUT_CHAR_BUDGET).text
+            else:
+                with open(path) as text_file:
+                    text = text_file.read()
+            documents.append((name, text))
+    return documents[:limit] if limit else documents
+
+
+def summarize_document(tokenizer, model, text, decoding):
+    # Same map-reduce as summarizer.get_summary_and_takeaways, without the scheduler
+    sections = list(islice(iter_token_sections(text, tokenizer=tokenizer), SUMMARY_MAX_SECTIONS))
+    if not sections:
+        return ""
+    summaries = generate_summaries(tokenizer, model, sections, decoding)
+    if len(summaries) == 1:
+        return summaries[0]
+    combined = next(iter_token_sections(" ".join(summaries), tokenizer=tokenizer), None)
+    return generate_summaries(tokenizer, model, [combined], decoding)[0] if combined else summaries[0]
+
+
+def _lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for token_a in a:
+        current = [0]
+        for j, token_b in enumerate(b, start=1):
+            current.append(previous[j - 1] + 1 if token_a == token_b else max(previous[j], current[j - 1]))
+        previous = current
+    return previous[-1]
+
+
+def _f1(overlap, candidate_len, reference_len):
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / candidate_len, overlap / reference_len
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_scores(candidate, reference):
+    candidate_tokens, reference_tokens = candidate.lower().split(), reference.lower().split()
+    if not candidate_tokens or not reference_tokens:
+        return 0.0, 0.0
+    reference_counts = {}
+    for token in reference_tokens:
+        reference_counts[token] = reference_counts.get(token, 0) + 1
+    unigram_overlap = 0
+    for token in candidate_tokens:
+        if reference_counts.get(token):
+            reference_counts[token] -= 1
+            unigram_overlap += 1
+    rouge_1 = _f1(unigram_overlap, len(candidate_tokens), len(reference_tokens))
+    rouge_l = _f1(_lcs_length(candidate_tokens, reference_tokens), len(candidate_tokens), len(reference_tokens))
+    return rouge_1, rouge_l
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def model_size_mb(model):
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def run_config(config, documents):
+    checkpoint, backend, decoding_name = parse_config(config)
+    decoding = DECODING_PRESETS[decoding_name]
+
+    started = time.perf_counter()
+    tokenizer = build_summarizer_tokenizer(checkpoint)
+    model = build_summarizer_model(checkpoint, backend)
+    load_seconds = time.perf_counter() - started
+
+    # One untimed run so lazy initialization doesn't count against the first paper
+    summarize_document(tokenizer, model, documents[0][1], decoding)
+
+    summaries, latencies = [], []
+    for _, text in documents:
+        started = time.perf_counter()
+        summaries.append(summarize_document(tokenizer, model, text, decoding))
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        "config": config,
+        "load_s": load_seconds,
+        "size_mb": model_size_mb(model),
+        "p50_s": percentile(latencies, 0.5),
+        "p95_s": percentile(latencies, 0.95),
+        "mean_s": statistics.mean(latencies),
+        "summaries": summaries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", help="Directory of PDF papers")
+    parser.add_argument("--texts", help="Directory of .txt papers")
+    parser.add_argument("--configs", default="fp32:beam4,int8:beam4,int8:greedy",
+                        help="Comma-separated [checkpoint@]backend:decoding list, the first is the reference")
+    parser.add_argument("--limit", type=int, help="Only use the first N papers")
+    args = parser.parse_args()
+
+    documents = load_documents(args.pdfs, args.texts, args.limit)
+    if not documents:
+        parser.error("No papers found, pass --pdfs and/or --texts")
+
+    results = [run_config(config, documents) for config in args.configs.split(",")]
+    reference = results[0]["summaries"]
+
+    print(f"{len(documents)} papers, reference: {results[0]['config']}")
+    print(f"{'config':<45} {'load s':>7} {'size MB':>8} {'p50 s':>7} {'p95 s':>7} {'mean s':>7} "
+          f"{'speedup':>8} {'ROUGE-1':>8} {'ROUGE-L':>8}")
+    for result in results:
+        scores = [rouge_scores(summary, ref) for summary, ref in zip(result["summaries"], reference)]
+        rouge_1 = statistics.mean(score[0] for score in scores)
+        rouge_l = statistics.mean(score[1] for score in scores)
+        speedup = results[0]["mean_s"] / result["mean_s"]
+        print(f"{result['config']:<45} {result['load_s']:>7.1f} {result['size_mb']:>8.0f} {result['p50_s']:>7.2f} "
+              f"{result['p95_s']:>7.2f} {result['mean_s']:>7.2f} {speedup:>7.2f}x {rouge_1:>8.3f} {rouge_l:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+Local stand-ins for the services the backend talks to, so its hot paths can be measured offline:
+an in-memory Drive service, an HTTP stub serving BibTeX in place of doi.org, an in-memory MongoDB
+(mongomock) and a tiny summarizer in place of BART.
+"""
+import datetime
+import hashlib
+import inspect
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PARENT = re.compile(r"'([^']+)' in parents")
+_NAME = re.compile(r"name\s*=\s*'([^']*)'")
+_MIMETYPE = re.compile(r"mimeType\s*=\s*'([^']*)'")
+
+
+class FakeDrive:
+    """
+    In-memory Drive v3 service with the files() calls the backend makes: list, get, get_media,
+    create and update (including resumable uploads), and the changes() feed. Every call sleeps
+    `latency` seconds first.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.files_by_id = {}
+        self.contents = {}
+        self.calls = Counter()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        # Ids of changed files, in order; a page token is an index into it plus one
+        self.change_log = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def changes(self):
+        return _FakeChanges(self)
+
+    def call(self, name, fn):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls[name] += 1
+            return fn()
+
+    def put(self, file_id, metadata, content):
+        drive_file = self.files_by_id.get(file_id, {"id": file_id, "headRevisionId": "0", "trashed": False})
+        drive_file.update(metadata)
+        if content is not None:
+            self.contents[file_id] = content
+            self.bytes_uploaded += len(content)
+            drive_file["md5Checksum"] = hashlib.md5(content).hexdigest()
+            drive_file["headRevisionId"] = str(int(drive_file["headRevisionId"]) + 1)
+        drive_file["modifiedTime"] = datetime.datetime.utcnow().isoformat() + "Z"
+        self.files_by_id[file_id] = drive_file
+        self.change_log.append(file_id)
+        return dict(drive_file)
+
+    def trash(self, file_id):
+        self.put(file_id, {"trashed": True}, None)
+
+
+def _media_bytes(media_body):
+    return media_body.getbytes(0, media_body.size()) if media_body is not None else None
+
+
+class _FakeRequest:
+    def __init__(self, drive, name, fn):
+        self.drive = drive
+        self.name = name
+        self.fn = fn
+
+    def execute(self, num_retries=0):
+        return self.drive.call(self.name, self.fn)
+
+    def next_chunk(self, num_retries=0):
+        # Resumable uploads finish in one chunk
+        return None, self.execute()
+
+
+class _FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q="", spaces=None, fields=None, **kwargs):
+        def run():
+            parent, name, mimetype = _PARENT.search(q), _NAME.search(q), _MIMETYPE.search(q)
+            files = [dict(drive_file) for drive_file in self.drive.files_by_id.values()
+                     if not drive_file["trashed"]
+                     and (not parent or parent.group(1) in drive_file.get("parents", []))
+                     and (not name or drive_file["name"] == name.group(1))
+                     and (not mimetype or drive_file.get("mimeType") == mimetype.group(1))]
+            return {"files": files}
+        return _FakeRequest(self.drive, "files.list", run)
+
+    def get(self, fileId, fields=None, **kwargs):
+        return _FakeRequest(self.drive, "files.get", lambda: dict(self.drive.files_by_id[fileId]))
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeMediaRequest(self.drive, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def run():
+            file_id = f"file{next(self.drive._ids)}"
+            metadata = dict(body or {})
+            if media_body is not None:
+                metadata.setdefault("mimeType", media_body.mimetype())
+            return self.drive.put(file_id, metadata, _media_bytes(media_body))
+        return _FakeRequest(self.drive, "files.create", run)
+
+    def update(self, fileId, body=None, media_body=None, fields=None, **kwargs):
+        return _FakeRequest(self.drive, "files.update",
+                            lambda: self.drive.put(fileId, dict(body or {}), _media_bytes(media_body)))
+
+
+class _FakeChanges:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        return _FakeRequest(self.drive, "changes.getStartPageToken",
+                            lambda: {"startPageToken": str(len(self.drive.change_log) + 1)})
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        def run():
+            start = int(pageToken) - 1
+            file_ids = self.drive.change_log[start:start + pageSize]
+            response = {"changes": [{"fileId": file_id, "removed": False,
+                                     "file": dict(self.drive.files_by_id[file_id])} for file_id in file_ids]}
+            if start + pageSize < len(self.drive.change_log):
+                response["nextPageToken"] = str(start + pageSize + 1)
+            else:
+                response["newStartPageToken"] = str(len(self.drive.change_log) + 1)
+            return response
+        return _FakeRequest(self.drive, "changes.list", run)
+
+
+class _FakeHttpResponse(dict):
+    status = 200
+
+
+class _FakeMediaRequest:
+    """
+    What MediaIoBaseDownload needs from files().get_media(): a uri, headers and an http object.
+    """
+
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.uri = f"fake://drive/{file_id}"
+        self.headers = {}
+        self.http = self
+        self.file_id = file_id
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        def run():
+            content = self.drive.contents[self.file_id]
+            self.drive.bytes_downloaded += len(content)
+            return content
+        content = self.drive.call("files.get_media", run)
+        return _FakeHttpResponse({"content-length": str(len(content))}), content
+
+
+def bibtex_for(doi, index=0):
+    return (f"@article{{paper{index},\n"
+            f"  title = {{Synthetic paper about {doi}}},\n"
+            f"  author = {{Doe, Jane and Roe, Richard}},\n"
+            f"  journal = {{Journal of Benchmarks}},\n"
+            f"  year = {{{2000 + index % 25}}},\n"
+            f"  pages = {{1--{10 + index % 20}}},\n"
+            f"  doi = {{{doi}}}\n"
+            f"}}")
+
+
+class DoiStubServer:
+    """
+    Serves canned BibTeX for any DOI on a local port; DOIs starting with 10.0000/ are unknown (404).
+    Set DOI_RESOLVER_URL to `url` before doi_resolver is imported.
+    """
+
+    def __init__(self, latency=0.0):
+        latency_seconds = latency
+        self.requests = Counter()
+        requests = self.requests
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency_seconds)
+                doi = self.path.lstrip("/")
+                requests["total"] += 1
+                if doi.startswith("10.0000/"):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = bibtex_for(doi, sum(map(ord, doi))).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-bibtex")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="doi-stub", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def install_mongomock():
+    """
+    Points mongo_db_ops at an in-memory mongomock database.
+    """
+    import mongomock
+    import mongomock.gridfs
+
+    import mongo_db_ops
+
+    mongomock.gridfs.enable_gridfs_integration()
+    # pymongo >= 4.11 passes a `sort` to bulk updates, which mongomock doesn't know about yet
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    if "sort" not in inspect.signature(add_update).parameters:
+        mongomock.collection.BulkOperationBuilder.add_update = \
+            lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs)
+    import gridfs
+
+    mongo_db_ops.client = mongomock.MongoClient()
+    mongo_db_ops.db = mongo_db_ops.client.research_ai
+    mongo_db_ops.ingestion_files = gridfs.GridFS(mongo_db_ops.db, collection="ingestion_files")
+    return mongo_db_ops.db
+
+
+class WhitespaceTokenizer:
+    """
+    Stand-in for the BART tokenizer: one id per whitespace-separated word.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.words = []
+        self._lock = threading.Lock()
+
+    def encode(self, text, add_special_tokens=False):
+        ids = []
+        with self._lock:
+            for word in text.split():
+                if word not in self.vocabulary:
+                    self.vocabulary[word] = len(self.words)
+                    self.words.append(word)
+                ids.append(self.vocabulary[word])
+        return ids
+
+    def decode(self, ids):
+        return " ".join(self.words[i] for i in ids)
+
+
+def install_tiny_summarizer(inference_ms=0.0, summary_words=40):
+    """
+    Replaces BART with a summarizer that returns the first `summary_words` words of each section,
+    spending `inference_ms` per batch plus a tenth of that per section to mimic batched inference.
+    """
+    from model_registry import model_registry
+    from summarizer import summary_scheduler
+
+    tokenizer = WhitespaceTokenizer()
+
+    def summarize_batch(token_sections):
+        time.sleep((inference_ms + inference_ms / 10 * len(token_sections)) / 1000)
+        return [tokenizer.decode(section[:summary_words]) for section in token_sections]
+
+    model_registry.set("summarizer_tokenizer", tokenizer)
+    model_registry.set("summarizer_model", summarize_batch)
+    summary_scheduler.batch_fn = summarize_batch
+    return tokenizer
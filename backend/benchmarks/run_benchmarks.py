@@ -0,0 +1,375 @@
+"""
+End-to-end benchmarks of the backend's hot paths against local stand-ins for Drive, doi.org and MongoDB
+(see benchmarks/fakes.py), with a tiny summarizer in place of BART.
+
+Run from the backend directory (needs the backend requirements plus benchmarks/requirements.txt):
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scenarios rapid_edits --rows 5000 --edits 500 --drive-latency-ms 80
+
+Scenarios:
+    doi_import   bulk /fetch_by_dois into an empty topic
+    pdf_parse    /parse_pdfs of generated PDFs (extraction, DOI resolution, summarization, persisting)
+    rapid_edits  bursts of concurrent /update_entry calls, then deletes and reads, on a large topic
+    topic_sync   /fetch_topics from the Drive catalog, then a sync after sheets were edited directly in Drive
+
+Every scenario reports, per stage, the number of calls, throughput and p50/p95/p99 latency.
+"""
+import argparse
+import asyncio
+import functools
+import io
+import json
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from benchmarks.fakes import DoiStubServer, FakeDrive, install_mongomock, install_tiny_summarizer
+
+USER_FOLDER = "benchmark-folder"
+WORDS = ("model data learning network graph protein analysis method results system neural training "
+         "sequence structure inference signal image language evaluation performance").split()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class StageRecorder:
+    """
+    Collects the latency of every call to the functions it wraps, grouped by stage name.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self._patches = []
+
+    def record(self, stage, seconds):
+        self.timings[stage].append(seconds)
+
+    def wrap(self, owner, attribute, stage):
+        original = getattr(owner, attribute)
+        if asyncio.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - started)
+        setattr(owner, attribute, timed)
+        self._patches.append((owner, attribute, original))
+
+    def restore(self):
+        for owner, attribute, original in reversed(self._patches):
+            setattr(owner, attribute, original)
+        self._patches = []
+
+    def report(self, wall_seconds):
+        rows = []
+        for stage, values in self.timings.items():
+            rows.append({
+                "stage": stage,
+                "calls": len(values),
+                "per_s": len(values) / wall_seconds if wall_seconds else 0.0,
+                "p50_ms": percentile(values, 0.5) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "mean_ms": statistics.mean(values) * 1000,
+            })
+        return rows
+
+
+def instrument(recorder, main):
+    """
+    Wraps the stages every scenario goes through; scenario-specific stages are wrapped by the scenario.
+    """
+    import doi_resolver
+    import summarizer
+    import topic_storage
+
+    storage = main.topic_storage
+    recorder.wrap(storage, "load", "storage.load")
+    for method in ("save", "add_entries", "update_entry", "delete_entry", "apply_batch"):
+        recorder.wrap(storage, method, f"storage.{method}")
+    if storage is not main.primary_storage:
+        recorder.wrap(main.primary_storage, "save", "storage.write_to_backend")
+    recorder.wrap(doi_resolver, "get_doi_bibtex", "doi.http")
+    recorder.wrap(summarizer.summary_scheduler, "batch_fn", "summarizer.batch")
+    recorder.wrap(topic_storage, "records_to_excel", "xlsx.serialize")
+    recorder.wrap(topic_storage, "excel_to_records", "xlsx.parse")
+
+
+def synthetic_entry(index):
+    rng = random.Random(index)
+    return {
+        "SL_NO": index + 1,
+        "NAME": f"Paper {index}: " + " ".join(rng.choice(WORDS) for _ in range(8)),
+        "YEAR": 1990 + index % 35,
+        "PUBLICATION": f"Journal {index % 40}",
+        "PAGE_NO": f"{index % 30}--{index % 30 + 12}",
+        "SUMMARY": " ".join(rng.choice(WORDS) for _ in range(120)),
+        "ABSTRACT": " ".join(rng.choice(WORDS) for _ in range(180)),
+        "DOI": f"10.5555/bench.{index}",
+        "AUTHOR": f"Author {index % 97} and Author {index % 89}",
+        "REMARKS": "",
+    }
+
+
+async def scenario_doi_import(main, recorder, args, drive):
+    recorder.wrap(main, "fetch_by_dois", "endpoint.fetch_by_dois")
+    recorder.wrap(main, "resolve_doi", "resolve_doi")
+    topic = "doi-import"
+    # A few unknown and repeated DOIs, like real pasted lists
+    dois = [f"10.1234/bench.{i}" for i in range(args.dois)]
+    dois += [f"10.0000/missing.{i}" for i in range(max(1, args.dois // 20))] + dois[:max(1, args.dois // 10)]
+    random.Random(0).shuffle(dois)
+    statuses = defaultdict(int)
+    for start in range(0, len(dois), args.doi_batch):
+        for result in await main.fetch_by_dois(dois[start:start + args.doi_batch], user_folder=USER_FOLDER,
+                                               topic=topic):
+            statuses[result["status"]] += 1
+    return {"dois": len(dois), **statuses}
+
+
+def generate_pdf(index, pages=6):
+    import fitz
+
+    rng = random.Random(index)
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page()
+        lines = []
+        if page_number == 0:
+            lines.append(f"A study of {rng.choice(WORDS)} {rng.choice(WORDS)} number {index}")
+            # Every fifth paper has no DOI
+            if index % 5:
+                lines.append(f"doi: 10.1234/pdf.{index}")
+        lines.extend(" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(45))
+        page.insert_text((50, 60), "\n".join(lines), fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+async def scenario_pdf_parse(main, recorder, args, drive):
+    from starlette.datastructures import UploadFile
+
+    recorder.wrap(main, "parse_pdfs", "endpoint.parse_pdfs")
+    recorder.wrap(main, "ingest_extracted_pdf", "ingest_pdf")
+    recorder.wrap(main, "parse_pdf_details", "resolve_pdf_doi")
+    recorder.wrap(main, "get_summary_and_takeaways", "summarize")
+    recorder.wrap(main, "check_duplicate", "dedupe")
+
+    pdfs = [generate_pdf(index) for index in range(args.pdfs)]
+    topic = "pdf-parse"
+    statuses = defaultdict(int)
+    for start in range(0, len(pdfs), args.pdf_batch):
+        files = [UploadFile(file=io.BytesIO(data), filename=f"paper{start + i}.pdf")
+                 for i, data in enumerate(pdfs[start:start + args.pdf_batch])]
+        for result in await main.parse_pdfs(files, user_folder=USER_FOLDER, topic=topic):
+            statuses[result["status"]] += 1
+    return {"pdfs": len(pdfs), **statuses}
+
+
+async def read_existing_data(main, topic, **query):
+    from starlette.requests import Request
+
+    params = {"offset": 0, "limit": None, "fields": None, "sort": None, "year": None, "publication": None,
+              "author": None}
+    params.update(query)
+    request = Request({"type": "http", "method": "GET", "headers": [], "query_string": b""})
+    response = await main.get_existing_data(request, user_folder=USER_FOLDER, topic=topic, **params)
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+async def scenario_rapid_edits(main, recorder, args, drive):
+    recorder.wrap(main, "update_entry", "endpoint.update_entry")
+    recorder.wrap(main, "delete_entry", "endpoint.delete_entry")
+    recorder.wrap(main, "batch_entries", "endpoint.batch_entries")
+
+    topic = "rapid-edits"
+    # Seeded straight into the backend, untimed and without notifying listeners
+    main.primary_storage.write([synthetic_entry(i) for i in range(args.rows)], USER_FOLDER, topic)
+
+    rng = random.Random(1)
+    targets = rng.sample(range(1, args.rows + 1), min(args.edits, args.rows))
+    for start in range(0, len(targets), args.burst):
+        burst = targets[start:start + args.burst]
+        await asyncio.gather(*(main.update_entry({"SL_NO": sl_no, "REMARKS": f"edit-{sl_no}"},
+                                                 user_folder=USER_FOLDER, topic=topic) for sl_no in burst))
+
+    for _ in range(args.reads):
+        started = time.perf_counter()
+        await read_existing_data(main, topic, limit=50, fields="NAME,YEAR,AUTHOR")
+        recorder.record("endpoint.existing_data_page", time.perf_counter() - started)
+
+    if hasattr(main.topic_storage, "flush"):
+        started = time.perf_counter()
+        main.topic_storage.flush(USER_FOLDER, topic)
+        recorder.record("flush", time.perf_counter() - started)
+
+    # Every edit must have survived the concurrency
+    records = main.primary_storage.load(USER_FOLDER, topic)
+    edited = {record["SL_NO"]: record["REMARKS"] for record in records}
+    lost = sum(1 for sl_no in targets if edited.get(sl_no) != f"edit-{sl_no}")
+
+    # Deletes from the end one by one, then the same number in one batch
+    deletes = min(args.deletes, args.rows // 4)
+    for sl_no in range(args.rows, args.rows - deletes, -1):
+        await main.delete_entry(main.DeleteRequest(no=sl_no), user_folder=USER_FOLDER, topic=topic)
+    operations = [main.EntryOperation(op="delete", SL_NO=sl_no) for sl_no in range(1, deletes + 1)]
+    await main.batch_entries(operations, user_folder=USER_FOLDER, topic=topic)
+
+    result = {"rows": args.rows, "edits": len(targets), "lost_edits": lost, "deletes": deletes * 2}
+    if hasattr(main.topic_storage, "stats"):
+        result["write_buffer"] = {key: value for key, value in main.topic_storage.stats().items()
+                                  if key in ("flushes", "writes", "coalesced_writes")}
+    return result
+
+
+async def scenario_topic_sync(main, recorder, args, drive):
+    if not main.drive_sync:
+        return {"skipped": "topics are not stored in Drive"}
+    import topic_cache
+
+    recorder.wrap(main, "fetch_topics", "endpoint.fetch_topics")
+    recorder.wrap(main.drive_sync, "sync", "drive_sync.sync")
+    storage = main.drive_storage
+    topics = [f"sync-topic-{i}" for i in range(args.topics)]
+    # Seeded straight into the backend, untimed and without notifying listeners
+    for topic in topics:
+        storage.write([synthetic_entry(i) for i in range(5)], USER_FOLDER, topic)
+
+    for _ in range(args.reads):
+        listed = (await main.fetch_topics(user_folder=USER_FOLDER))["topics"]
+
+    # Sheets changed and one trashed directly in Drive, with their records cached beforehand
+    edited = topics[:args.external_edits]
+    trashed = topics[-1]
+    files = {drive_file["name"]: file_id for file_id, drive_file in drive.files_by_id.items()}
+    for topic in edited + [trashed]:
+        storage.load(USER_FOLDER, topic)
+    for topic in edited:
+        records = [dict(synthetic_entry(i), REMARKS="edited in Drive") for i in range(5)]
+        drive.put(files[f"{topic}{storage.extension}"], {}, storage.serialize(records))
+    drive.trash(files[f"{trashed}{storage.extension}"])
+
+    changed = await main.sync_drive(user_folder=USER_FOLDER)
+    listed_after = (await main.fetch_topics(user_folder=USER_FOLDER))["topics"]
+    still_cached = sum(1 for topic in edited + [trashed] if topic_cache.topic_cache.get((USER_FOLDER, topic)))
+    return {"topics": len(topics), "listings": args.reads, "external_changes": len(edited) + 1,
+            "changed_topics": len(changed["changed_topics"]), "stale_cache_entries": still_cached,
+            "listing_correct": set(topics) <= set(listed) and trashed not in listed_after}
+
+
+SCENARIOS = {
+    "doi_import": scenario_doi_import,
+    "pdf_parse": scenario_pdf_parse,
+    "rapid_edits": scenario_rapid_edits,
+    "topic_sync": scenario_topic_sync,
+}
+
+
+def print_report(name, result, rows, wall_seconds, drive_calls):
+    print(f"\n== {name}: {wall_seconds:.2f} s  {json.dumps(result)}")
+    print(f"   drive calls: {json.dumps(drive_calls)}")
+    print(f"   {'stage':<32} {'calls':>6} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for row in sorted(rows, key=lambda row: row["stage"]):
+        print(f"   {row['stage']:<32} {row['calls']:>6} {row['per_s']:>9.1f} {row['p50_ms']:>9.2f} "
+              f"{row['p95_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['mean_ms']:>9.2f}")
+
+
+async def run(args, doi_stub):
+    # Configuration is read at import time, so the backend is imported only now
+    install_mongomock()
+    import drive_sync
+    import main
+    import topic_storage
+
+    drive = FakeDrive(latency=args.drive_latency_ms / 1000)
+    topic_storage.get_user_service = lambda user_folder: drive
+    drive_sync.get_user_service = lambda user_folder: drive
+    install_tiny_summarizer(inference_ms=args.inference_ms)
+
+    await main.start_workers()
+    results = {}
+    try:
+        for name in args.scenarios.split(","):
+            recorder = StageRecorder()
+            instrument(recorder, main)
+            drive.calls.clear()
+            started = time.perf_counter()
+            result = await SCENARIOS[name](main, recorder, args, drive)
+            if hasattr(main.topic_storage, "flush_all"):
+                # Buffered writes are part of the scenario's cost
+                flush_started = time.perf_counter()
+                main.topic_storage.flush_all()
+                recorder.record("flush_all", time.perf_counter() - flush_started)
+            wall_seconds = time.perf_counter() - started
+            recorder.restore()
+            rows = recorder.report(wall_seconds)
+            drive_calls = dict(drive.calls, bytes_up=drive.bytes_uploaded, bytes_down=drive.bytes_downloaded)
+            print_report(name, result, rows, wall_seconds, drive_calls)
+            results[name] = {"wall_s": wall_seconds, "result": result, "stages": rows, "drive": drive_calls}
+    finally:
+        await main.stop_workers()
+    results["doi_stub_requests"] = doi_stub.requests["total"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--dois", type=int, default=200, help="DOIs imported by doi_import")
+    parser.add_argument("--doi-batch", type=int, default=50, help="DOIs per /fetch_by_dois request")
+    parser.add_argument("--pdfs", type=int, default=50, help="PDFs parsed by pdf_parse")
+    parser.add_argument("--pdf-batch", type=int, default=10, help="PDFs per /parse_pdfs request")
+    parser.add_argument("--rows", type=int, default=5000, help="Entries in the rapid_edits topic")
+    parser.add_argument("--edits", type=int, default=200, help="Edits made by rapid_edits")
+    parser.add_argument("--burst", type=int, default=20, help="Concurrent edits per burst")
+    parser.add_argument("--deletes", type=int, default=20, help="Single deletes (and batched deletes)")
+    parser.add_argument("--reads", type=int, default=20, help="Paged /existing_data reads")
+    parser.add_argument("--topics", type=int, default=200, help="Topics in the topic_sync folder")
+    parser.add_argument("--external-edits", type=int, default=10, help="Sheets topic_sync edits directly in Drive")
+    parser.add_argument("--drive-latency-ms", type=float, default=0, help="Added to every Drive call")
+    parser.add_argument("--doi-latency-ms", type=float, default=0, help="Added to every doi.org request")
+    parser.add_argument("--inference-ms", type=float, default=20, help="Cost of one summarizer batch")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios {sorted(unknown)}, expected some of {list(SCENARIOS)}")
+
+    doi_stub = DoiStubServer(latency=args.doi_latency_ms / 1000).start()
+    os.environ["DOI_RESOLVER_URL"] = doi_stub.url
+    os.environ.setdefault("MODEL_WARMUP", "false")
+    # OAuth is never exercised, but main.py reads its configuration on import
+    os.environ.setdefault("GOOGLE_REDIRECT_URIS", "[]")
+    if not os.environ.get("ENCRYPTION_KEY"):
+        # Tokens are never stored by the benchmarks, any key will do
+        from cryptography.fernet import Fernet
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+    try:
+        results = asyncio.run(run(args, doi_stub))
+    finally:
+        doi_stub.stop()
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+MISSING = object()
+
+# Every live cache, for metrics
+all_caches = weakref.WeakSet()
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache.
+    By default every entry counts as 1 towards `max_size`; pass `sizeof` to bound the cache by
+    another measure (e.g. bytes) instead.
+    """
+
+    def __init__(self, max_size, sizeof=None, name="cache"):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.name = name
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        all_caches.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, MISSING)
+            if value is MISSING:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                return  # Larger than the whole cache, never worth keeping
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._size += size
+            while self._size > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, default)
+            self._remove(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._size = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self._size -= self._sizes.pop(key)
@@ -0,0 +1,138 @@
+import datetime
+import os
+import threading
+
+import bibtexparser
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache_utils import LRUCache, MISSING
+from metrics import timed
+from mongo_db_ops import ensure_doi_cache_indexes, get_cached_doi, store_cached_doi
+
+DOI_RESOLVER_URL = os.environ.get("DOI_RESOLVER_URL", "https://doi.org").rstrip("/")
+DOI_CONNECT_TIMEOUT = float(os.environ.get("DOI_CONNECT_TIMEOUT", "5"))
+DOI_READ_TIMEOUT = float(os.environ.get("DOI_READ_TIMEOUT", "15"))
+DOI_POOL_SIZE = int(os.environ.get("DOI_POOL_SIZE", "16"))
+DOI_CACHE_SIZE = int(os.environ.get("DOI_CACHE_SIZE", "4096"))
+DOI_CACHE_TTL = datetime.timedelta(days=float(os.environ.get("DOI_CACHE_TTL_DAYS", "30")))
+# DOIs that fail to resolve are remembered for a shorter time, so a temporary outage heals itself
+DOI_NEGATIVE_CACHE_TTL = datetime.timedelta(hours=float(os.environ.get("DOI_NEGATIVE_CACHE_TTL_HOURS", "6")))
+
+# Keep-alive connection pool shared by every DOI lookup
+session = requests.Session()
+session.headers.update({"Accept": "text/bibliography; style=bibtex"})
+_adapter = HTTPAdapter(pool_connections=DOI_POOL_SIZE, pool_maxsize=DOI_POOL_SIZE,
+                       max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504),
+                                         allowed_methods=frozenset(["GET"])))
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+# In-process front of the MongoDB cache; values are {"bibtex": ..., "metadata": ..., "expires_at": ...}
+doi_memory_cache = LRUCache(DOI_CACHE_SIZE, name="doi")
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+
+def normalize_doi(doi):
+    # DOIs are case-insensitive
+    return doi.strip().lower()
+
+
+@timed("doi.fetch_bibtex")
+def get_doi_bibtex(doi):
+    response = session.get(f"{DOI_RESOLVER_URL}/{doi}", timeout=(DOI_CONNECT_TIMEOUT, DOI_READ_TIMEOUT))
+    if response.status_code == 200:
+        bibtex_str = response.text.strip()
+        bibtex_str = bibtex_str.encode('latin1', errors='ignore').decode('utf-8',
+                                                                         errors='ignore')  # Decode using Latin-1, then re-encode as UTF-8
+        return bibtex_str
+    else:
+        return None
+
+
+def bibtex_to_json(bibtex_str):
+    bib_database = bibtexparser.loads(bibtex_str)
+    # Entries are already plain dicts of strings
+    return [dict(entry) for entry in bib_database.entries]
+
+
+def metadata_to_paper_info(metadata):
+    return {
+        "NAME": metadata.get("title", "Unknown"),
+        "YEAR": metadata.get("year", "Unknown"),
+        "PUBLICATION": metadata.get("journal", "Unknown"),
+        "PAGE_NO": metadata.get("pages", "Unknown"),
+        "ABSTRACT": metadata.get("abstract", "Unknown"),
+        "DOI": metadata.get("doi", "Unknown"),
+        "AUTHOR": metadata.get("author", "Unknown"),
+        "REMARKS": ""
+    }
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if not _indexes_ready:
+            ensure_doi_cache_indexes()
+            _indexes_ready = True
+
+
+def _lookup_persistent_cache(key):
+    try:
+        _ensure_indexes()
+        return get_cached_doi(key)
+    except Exception as e:
+        # The cache is an optimization, resolving must keep working without it
+        print(f"Error reading DOI cache: {e}")
+        return None
+
+
+def _store_persistent_cache(key, bibtex, metadata, ttl):
+    try:
+        store_cached_doi(key, bibtex, metadata, ttl)
+    except Exception as e:
+        print(f"Error writing DOI cache: {e}")
+
+
+def resolve_doi(doi):
+    """
+    Returns the parsed BibTeX metadata of a DOI, or None if it can't be resolved.
+    Looks in the in-process LRU, then MongoDB, then doi.org. Failures are cached too.
+    """
+    if not doi or doi == "Unknown":
+        return None
+    key = normalize_doi(doi)
+
+    cached = doi_memory_cache.get(key, MISSING)
+    # Expires like the MongoDB copy, so a DOI that failed to resolve is retried after DOI_NEGATIVE_CACHE_TTL
+    if cached is not MISSING and cached["expires_at"] < datetime.datetime.utcnow():
+        doi_memory_cache.pop(key)
+        cached = MISSING
+    if cached is MISSING:
+        cached = _lookup_persistent_cache(key)
+        if cached is not None:
+            cached = {"bibtex": cached["bibtex"], "metadata": cached["metadata"],
+                      "expires_at": cached["expires_at"]}
+            doi_memory_cache.set(key, cached)
+
+    if cached is None:
+        try:
+            bibtex = get_doi_bibtex(doi)
+        except requests.RequestException as e:
+            # Network errors are not cached, the next request tries again
+            print(f"Error resolving DOI {doi}: {e}")
+            return None
+        entries = bibtex_to_json(bibtex) if bibtex else []
+        metadata = entries[0] if entries else None
+        ttl = DOI_CACHE_TTL if metadata else DOI_NEGATIVE_CACHE_TTL
+        cached = {"bibtex": bibtex, "metadata": metadata, "expires_at": datetime.datetime.utcnow() + ttl}
+        doi_memory_cache.set(key, cached)
+        _store_persistent_cache(key, bibtex, metadata, ttl)
+
+    # Callers get their own copy so they can't change the cached entry
+    return dict(cached["metadata"]) if cached["metadata"] else None
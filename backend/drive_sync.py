@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from google_drive_helper import get_user_service
+from metrics import span
+from mongo_db_ops import ensure_drive_catalog_indexes, get_drive_sync_state, store_drive_sync_state, \
+    mark_drive_catalog_stale, get_catalog_files, get_catalog_files_by_id, upsert_catalog_files, \
+    delete_catalog_files, replace_catalog_files
+from topic_cache import TOPIC_REVISION_FIELDS, drop_stale_records, file_revision
+
+# Seconds between background syncs of the users that listed their topics recently; 0 only syncs on demand
+DRIVE_SYNC_INTERVAL = float(os.environ.get("DRIVE_SYNC_INTERVAL", "60"))
+# Users are synced in the background for this long after they last listed their topics
+DRIVE_SYNC_ACTIVE_SECONDS = float(os.environ.get("DRIVE_SYNC_ACTIVE_SECONDS", "3600"))
+DRIVE_PAGE_SIZE = 1000
+
+CHANGE_FIELDS = (f'nextPageToken, newStartPageToken, '
+                 f'changes(fileId, removed, file({TOPIC_REVISION_FIELDS}, mimeType, parents, trashed))')
+LIST_FIELDS = f'nextPageToken, files({TOPIC_REVISION_FIELDS}, mimeType)'
+
+
+class DriveSync:
+    """
+    Keeps a catalog of each user's topic files (id, name, modifiedTime, checksum) in MongoDB, in step with
+    Drive through the changes feed: a sync only fetches what changed since the stored page token, so its
+    cost follows the number of changes rather than the size of the folder. The first sync of a user, and
+    one whose page token expired, lists the folder instead.
+
+    Topics changed outside this process have their cached records dropped and are passed to the listeners.
+    """
+
+    def __init__(self, storage, interval=DRIVE_SYNC_INTERVAL):
+        self.storage = storage
+        self.interval = interval
+        self._listeners = []
+        # user_folder -> time of its last topic listing
+        self._active = {}
+        self._user_locks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._indexes_ready = False
+        self._syncs = 0
+        self._full_syncs = 0
+        self._changes = 0
+        self._errors = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def start(self):
+        with self._lock:
+            if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="drive-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        self._stop.set()
+        if thread and thread.is_alive():
+            thread.join(timeout)
+
+    def topic_changed(self, user_folder, topic):
+        """
+        Topic storage listener: our own write may have created a topic file the catalog doesn't know yet.
+        """
+        mark_drive_catalog_stale(user_folder)
+
+    def list_topics(self, user_folder):
+        with self._lock:
+            self._active[user_folder] = time.monotonic()
+        self._ensure_indexes()
+        state = get_drive_sync_state(user_folder)
+        if not state or not state.get("page_token") \
+                or state.get("local_writes", 0) != state.get("synced_writes", 0):
+            self.sync(user_folder)
+        return sorted(file["topic"] for file in get_catalog_files(user_folder))
+
+    def sync(self, user_folder):
+        """
+        Brings the catalog of a user up to date. Returns the topics that changed.
+        """
+        self._ensure_indexes()
+        with self._user_lock(user_folder), span("drive.sync"):
+            state = get_drive_sync_state(user_folder) or {}
+            # Read first: writes made while we sync leave the catalog marked stale
+            local_writes = state.get("local_writes", 0)
+            service = get_user_service(user_folder)
+            try:
+                if state.get("page_token"):
+                    try:
+                        changed = self._apply_changes(service, user_folder, state["page_token"], local_writes)
+                    except HttpError as e:
+                        if e.resp.status not in (400, 404, 410):
+                            raise
+                        print(f"Drive changes token of {user_folder} is no longer valid, listing the folder")
+                        changed = self._full_sync(service, user_folder, local_writes)
+                else:
+                    changed = self._full_sync(service, user_folder, local_writes)
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                raise
+
+        for topic in changed:
+            for listener in self._listeners:
+                try:
+                    listener(user_folder, topic)
+                except Exception as e:
+                    print(f"Error in Drive sync listener for {topic}: {e}")
+        with self._lock:
+            self._syncs += 1
+        return sorted(changed)
+
+    def _ensure_indexes(self):
+        if not self._indexes_ready:
+            ensure_drive_catalog_indexes()
+            self._indexes_ready = True
+
+    def _user_lock(self, user_folder):
+        with self._lock:
+            return self._user_locks.setdefault(user_folder, threading.Lock())
+
+    def _topic_name(self, drive_file):
+        name = drive_file.get('name', '')
+        if drive_file.get('mimeType') != self.storage.mimetype or not name.endswith(self.storage.extension):
+            return None
+        return name[:-len(self.storage.extension)]
+
+    def _catalog_file(self, drive_file):
+        return {"_id": drive_file['id'], "topic": self._topic_name(drive_file), "name": drive_file['name'],
+                "modifiedTime": drive_file.get('modifiedTime'), "md5Checksum": drive_file.get('md5Checksum'),
+                "revision": file_revision(drive_file)}
+
+    def _topic_file_changed(self, user_folder, topic, drive_file):
+        # Our own writes already put the new revision in the topic cache; anything else is news
+        return not drop_stale_records(user_folder, topic, drive_file)
+
+    def _full_sync(self, service, user_folder, local_writes):
+        # Taken before listing, so changes made during the listing are replayed by the next sync
+        page_token = service.changes().getStartPageToken().execute()['startPageToken']
+        files, list_token = [], None
+        while True:
+            response = service.files().list(
+                q=f"'{user_folder}' in parents and mimeType='{self.storage.mimetype}' and trashed = false",
+                spaces='drive', fields=LIST_FIELDS, pageSize=DRIVE_PAGE_SIZE, pageToken=list_token).execute()
+            files.extend(drive_file for drive_file in response.get('files', []) if self._topic_name(drive_file))
+            list_token = response.get('nextPageToken')
+            if not list_token:
+                break
+
+        previous = {file["_id"]: file for file in get_catalog_files(user_folder)}
+        current = {}
+        changed = set()
+        for drive_file in files:
+            catalog_file = current[drive_file['id']] = self._catalog_file(drive_file)
+            known = previous.get(drive_file['id'])
+            # A user's first listing only builds the catalog; it doesn't report every topic as changed
+            if previous and (not known or known["revision"] != catalog_file["revision"]) \
+                    and self._topic_file_changed(user_folder, catalog_file["topic"], drive_file):
+                changed.add(catalog_file["topic"])
+        for file_id, known in previous.items():
+            if file_id not in current:
+                drop_stale_records(user_folder, known["topic"])
+                changed.add(known["topic"])
+
+        replace_catalog_files(user_folder, list(current.values()))
+        store_drive_sync_state(user_folder, page_token, local_writes)
+        with self._lock:
+            self._full_syncs += 1
+            self._changes += len(files)
+        return changed
+
+    def _apply_changes(self, service, user_folder, page_token, local_writes):
+        changes = []
+        while True:
+            response = service.changes().list(pageToken=page_token, spaces='drive', fields=CHANGE_FIELDS,
+                                              pageSize=DRIVE_PAGE_SIZE, includeRemoved=True).execute()
+            changes.extend(response.get('changes', []))
+            if 'newStartPageToken' in response:
+                page_token = response['newStartPageToken']
+                break
+            page_token = response['nextPageToken']
+
+        # Only the catalog documents of the files that changed are read
+        catalog = {file["_id"]: file for file in
+                   get_catalog_files_by_id(user_folder, {change['fileId'] for change in changes})}
+        upserts, deletes, changed = {}, set(), set()
+        # Changes come oldest first; a file changed several times ends up in its latest state
+        for change in changes:
+            file_id, drive_file = change['fileId'], change.get('file')
+            known = catalog.get(file_id)
+            in_folder = (not change.get('removed') and drive_file and not drive_file.get('trashed')
+                         and user_folder in drive_file.get('parents', []) and self._topic_name(drive_file))
+            if in_folder:
+                catalog_file = self._catalog_file(drive_file)
+                if known and known["topic"] != catalog_file["topic"]:
+                    drop_stale_records(user_folder, known["topic"])
+                    changed.add(known["topic"])
+                if (not known or known["revision"] != catalog_file["revision"]
+                        or known["topic"] != catalog_file["topic"]) \
+                        and self._topic_file_changed(user_folder, catalog_file["topic"], drive_file):
+                    changed.add(catalog_file["topic"])
+                catalog[file_id] = upserts[file_id] = catalog_file
+                deletes.discard(file_id)
+            elif known:
+                # Trashed, deleted, moved out of the folder or no longer a topic file
+                drop_stale_records(user_folder, known["topic"])
+                changed.add(known["topic"])
+                catalog.pop(file_id)
+                upserts.pop(file_id, None)
+                deletes.add(file_id)
+
+        delete_catalog_files(deletes)
+        upsert_catalog_files(user_folder, list(upserts.values()))
+        store_drive_sync_state(user_folder, page_token, local_writes)
+        with self._lock:
+            self._changes += len(changes)
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                for user_folder, last_listed in list(self._active.items()):
+                    if now - last_listed > DRIVE_SYNC_ACTIVE_SECONDS:
+                        del self._active[user_folder]
+                users = list(self._active)
+            for user_folder in users:
+                try:
+                    self.sync(user_folder)
+                except Exception as e:
+                    print(f"Error syncing Drive changes of {user_folder}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interval_s": self.interval,
+                "active_users": len(self._active),
+                "syncs": self._syncs,
+                "full_syncs": self._full_syncs,
+                "changes": self._changes,
+                "errors": self._errors,
+            }
@@ -0,0 +1,37 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking network calls: Drive, doi.org and MongoDB
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", "32"))
+# CPU-bound work that runs in-process: tokenization, spreadsheet (de)serialization
+CPU_POOL_SIZE = int(os.environ.get("CPU_POOL_SIZE", str(os.cpu_count() or 1)))
+
+io_executor = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+
+
+async def run_io(fn, *args, **kwargs):
+    """
+    Runs a blocking network call in the I/O pool so the event loop keeps serving other requests.
+    """
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context, so request-scoped state (e.g. timings) follows the call
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Runs CPU-bound work in the CPU pool, whose size keeps it from starving the I/O pool of cores.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(cpu_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    io_executor.shutdown(wait=False, cancel_futures=True)
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
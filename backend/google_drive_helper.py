@@ -1,20 +1,121 @@
+import datetime
 import os
+import threading
+import time
 
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+import requests
+from google.auth.transport.requests import Request
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
 
-from mongo_db_ops import get_tokens
+from cache_utils import LRUCache
+from metrics import drive_bytes, timed
+from mongo_db_ops import get_tokens, store_tokens, get_user_id
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+# Resumable uploads send the file in chunks of this size (a multiple of 256 KiB, as Drive requires)
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# Retries of a failed chunk, with exponential backoff
+UPLOAD_CHUNK_RETRIES = int(os.environ.get("UPLOAD_CHUNK_RETRIES", "5"))
+
+# Credentials are refreshed this long before they expire, so requests never wait on an expired token
+CREDENTIALS_REFRESH_MARGIN = datetime.timedelta(seconds=int(os.environ.get("CREDENTIALS_REFRESH_MARGIN", "300")))
+DRIVE_CREDENTIALS_CACHE_SIZE = int(os.environ.get("DRIVE_CREDENTIALS_CACHE_SIZE", "1024"))
+# Built services are not thread-safe, so every thread keeps its own for the users it served last
+DRIVE_SERVICES_PER_THREAD = int(os.environ.get("DRIVE_SERVICES_PER_THREAD", "32"))
+# Optional path to a local copy of the Drive v3 discovery document
+DRIVE_DISCOVERY_DOCUMENT = os.environ.get("DRIVE_DISCOVERY_DOCUMENT")
+DRIVE_DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+# username -> google.oauth2.credentials.Credentials
+_credentials_cache = LRUCache(DRIVE_CREDENTIALS_CACHE_SIZE, name="drive_credentials")
+# Striped locks so refreshes for one user are serialized without one lock per user
+_credential_locks = [threading.Lock() for _ in range(64)]
+_thread_services = threading.local()
+
+
+def get_drive_discovery_document():
+    """
+    Loads the Drive v3 discovery document once per process: from DRIVE_DISCOVERY_DOCUMENT if set,
+    otherwise from the static copy bundled with google-api-python-client.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            if DRIVE_DISCOVERY_DOCUMENT:
+                with open(DRIVE_DISCOVERY_DOCUMENT) as document:
+                    _discovery_document = document.read()
+            else:
+                _discovery_document = discovery_cache.get_static_doc('drive', 'v3')
+            if _discovery_document is None:
+                # Older client libraries don't bundle the documents; fetch it once instead
+                response = requests.get(DRIVE_DISCOVERY_URL, timeout=30)
+                response.raise_for_status()
+                _discovery_document = response.text
+        return _discovery_document
+
+
+def _needs_refresh(credentials):
+    if not credentials.expiry:
+        return False
+    return credentials.expiry - datetime.datetime.utcnow() < CREDENTIALS_REFRESH_MARGIN
+
+
+def get_credentials(username):
+    with _credential_locks[hash(username) % len(_credential_locks)]:
+        credentials = _credentials_cache.get(username)
+        if credentials is None:
+            credentials = get_tokens(username)
+            _credentials_cache.set(username, credentials)
+
+        if _needs_refresh(credentials) and credentials.refresh_token:
+            try:
+                credentials.refresh(Request())
+            except Exception:
+                _credentials_cache.pop(username)
+                raise
+            # Persist once per refresh; other threads wait on the lock and reuse the new token
+            store_tokens(username, credentials)
+        return credentials
+
+
+def invalidate_credentials(username):
+    """
+    Drops the pooled credentials of a user, e.g. after new tokens were stored for them.
+    """
+    with _credential_locks[hash(username) % len(_credential_locks)]:
+        _credentials_cache.pop(username)
+
 
 # Authentication function (synchronous)
+@timed("drive.authenticate")
 def authenticate(username=None):
-    creds = get_tokens(username)
-    service = build('drive', 'v3', credentials=creds)
+    credentials = get_credentials(username)
+
+    services = getattr(_thread_services, "services", None)
+    if services is None:
+        services = _thread_services.services = LRUCache(DRIVE_SERVICES_PER_THREAD, name="drive_services")
+
+    # Reuse this thread's service as long as it was built with the current credentials
+    cached = services.get(username)
+    if cached and cached[1] is credentials:
+        return cached[0]
+
+    service = build_from_document(get_drive_discovery_document(), credentials=credentials)
+    services.set(username, (service, credentials))
     return service
 
 
+def get_user_service(user_folder):
+    return authenticate(get_user_id(user_folder))
+
+
 # Create folder function (synchronous)
 def create_folder(service, folder_name):
     file_metadata = {
@@ -35,6 +136,35 @@ def upload_file(service, file_path, folder_id):
     return file.get('id')
 
 
+# Streaming upload function (synchronous)
+def upload_stream(service, stream, file_name, folder_id, mimetype='application/octet-stream'):
+    """
+    Uploads a binary stream with a resumable upload, reading it one chunk at a time.
+    A chunk that still fails after the client's own retries is resumed from the last byte Drive acknowledged.
+    """
+    file_metadata = {'name': file_name, 'parents': [folder_id]}
+    media = MediaIoBaseUpload(stream, mimetype=mimetype, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+    drive_bytes.inc("upload", amount=media.size())
+    request = service.files().create(body=file_metadata, media_body=media, fields='id')
+
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            # next_chunk itself retries 5xx, 429 and connection errors num_retries times
+            _, response = request.next_chunk(num_retries=UPLOAD_CHUNK_RETRIES)
+            failures = 0
+        except (HttpError, ConnectionError, TimeoutError) as e:
+            if isinstance(e, HttpError) and e.resp.status < 500 and e.resp.status != 429:
+                raise
+            failures += 1
+            if failures > UPLOAD_CHUNK_RETRIES:
+                raise
+            print(f"Retrying upload of {file_name} after error: {e}")
+            time.sleep(min(2 ** failures, 30))
+    return response.get('id')
+
+
 # Download file function (synchronous)
 def download_file(service, file_id, destination):
     request = service.files().get_media(fileId=file_id)
@@ -45,3 +175,4 @@ def download_file(service, file_id, destination):
             # Synchronous call to download the file chunk by chunk
             status, done = downloader.next_chunk()
             print(f"Download {int(status.progress() * 100)}%.")
+        drive_bytes.inc("download", amount=fh.tell())
@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class InferenceScheduler:
+    """
+    Collects inference requests from every caller into one queue and runs them in batches.
+
+    A single worker thread takes the first waiting request, then keeps pulling more until either
+    `max_batch_size` requests are collected or `max_wait` seconds have passed since the first one.
+    The whole batch is handed to `batch_fn` in one call and each result is sent back to the
+    future returned by `submit`.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait=0.05, name="inference"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._max_batch = 0
+        self._batch_sizes = {}
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, item):
+        """
+        Queue a single item and return a `concurrent.futures.Future` for its result.
+        Async callers can await it with `asyncio.wrap_future`.
+        """
+        self.start()
+        future = Future()
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    def stats(self):
+        with self._lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "name": self.name,
+                "running": bool(self._thread and self._thread.is_alive()),
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": batches,
+                "items": items,
+                "errors": self._errors,
+                "avg_batch_size": items / batches if batches else 0.0,
+                "largest_batch": self._max_batch,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": self._total_wait / items * 1000 if items else 0.0,
+                "avg_batch_run_ms": self._total_run / batches * 1000 if batches else 0.0,
+            }
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Put the sentinel back so the loop exits after this batch is done
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect_batch(first)
+
+            # Drop requests whose callers already gave up
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(batch)} inputs")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._lock:
+                    self._errors += 1
+                self._record(batch, started)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+            self._record(batch, started)
+
+    def _record(self, batch, started):
+        finished = time.monotonic()
+        with self._lock:
+            size = len(batch)
+            self._batches += 1
+            self._items += size
+            self._max_batch = max(self._max_batch, size)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._total_wait += sum(started - enqueued for _, _, enqueued in batch)
+            self._total_run += finished - started
@@ -0,0 +1,139 @@
+import asyncio
+import datetime
+import os
+import uuid
+
+from executors import run_io
+from mongo_db_ops import ensure_ingestion_job_indexes, store_ingestion_file, load_ingestion_file, \
+    delete_ingestion_file, create_ingestion_job, get_ingestion_job, update_ingestion_file, \
+    finish_ingestion_job_if_complete, claim_unfinished_ingestion_job, renew_ingestion_leases, \
+    release_ingestion_leases, INGESTION_TERMINAL_STATUSES
+from paper_fingerprints import DuplicatePaper
+
+# Number of files processed at the same time across all jobs
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "4"))
+# A job whose owner hasn't renewed it for this long is taken over by another process
+INGESTION_LEASE = datetime.timedelta(seconds=int(os.environ.get("INGESTION_LEASE_SECONDS", "600")))
+# How long finished jobs stay available for polling
+INGESTION_RETENTION = datetime.timedelta(hours=int(os.environ.get("INGESTION_RETENTION_HOURS", "24")))
+
+
+class IngestionJobManager:
+    """
+    Runs PDF ingestion jobs in the background.
+
+    `pipeline` is the coroutine that ingests one file:
+    `pipeline(user_folder, topic, filename, pdf_bytes, report_stage)` returns the new entry, or raises
+    DuplicatePaper if the paper is already in the topic, and awaits `report_stage(stage)` as it moves through its stages.
+    Job and file progress is stored in MongoDB, so any process can report it and unfinished jobs are
+    resumed after a restart.
+    """
+
+    def __init__(self, pipeline, workers=INGESTION_WORKERS):
+        self.pipeline = pipeline
+        self.workers = max(1, workers)
+        self.owner = uuid.uuid4().hex
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        try:
+            await run_io(ensure_ingestion_job_indexes)
+        except Exception as e:
+            print(f"Error creating ingestion job indexes: {e}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._renew_leases()))
+        await self.resume()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Files that were queued or in progress are picked up by the next process instead of after the lease
+        try:
+            await run_io(release_ingestion_leases, self.owner)
+        except Exception as e:
+            print(f"Error releasing ingestion leases: {e}")
+
+    async def submit(self, user_folder, topic, named_pdfs):
+        """
+        Stores the PDFs, creates the job and queues its files. Returns the job id right away.
+        """
+        job_id = uuid.uuid4().hex
+        files = []
+        for name, pdf_bytes in named_pdfs:
+            files.append({"name": name, "file_id": await run_io(store_ingestion_file, name, pdf_bytes)})
+        await run_io(create_ingestion_job, job_id, user_folder, topic, files, self.owner, INGESTION_LEASE)
+        for index, file in enumerate(files):
+            self._queue.put_nowait((job_id, user_folder, topic, index, file["name"], file["file_id"]))
+        return job_id
+
+    async def get_job(self, job_id):
+        return await run_io(get_ingestion_job, job_id)
+
+    async def resume(self):
+        """
+        Requeues the pending files of every job left unfinished by a stopped process. Runs at startup and
+        then periodically.
+        """
+        while True:
+            try:
+                job = await run_io(claim_unfinished_ingestion_job, self.owner, INGESTION_LEASE)
+            except Exception as e:
+                print(f"Error resuming ingestion jobs: {e}")
+                return
+            if not job:
+                return
+            print(f"Resuming ingestion job {job['job_id']}")
+            for index, file in enumerate(job["files"]):
+                if file["status"] not in INGESTION_TERMINAL_STATUSES:
+                    self._queue.put_nowait((job["job_id"], job["user_folder"], job["topic"], index, file["name"],
+                                            file["file_id"]))
+            # A job can be left with nothing pending if the process stopped right before finishing it
+            await run_io(finish_ingestion_job_if_complete, job["job_id"], INGESTION_RETENTION)
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(INGESTION_LEASE.total_seconds() / 3)
+            try:
+                await run_io(renew_ingestion_leases, self.owner, INGESTION_LEASE)
+            except Exception as e:
+                print(f"Error renewing ingestion leases: {e}")
+            # Jobs of a process that died without releasing them become claimable once their lease runs out
+            try:
+                await self.resume()
+            except Exception as e:
+                print(f"Error resuming ingestion jobs: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id, user_folder, topic, index, name, file_id = await self._queue.get()
+            try:
+                await self._process(job_id, user_folder, topic, index, name, file_id)
+            except Exception as e:
+                print(f"Error in ingestion job {job_id} for file {name}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id, user_folder, topic, index, name, file_id):
+        async def report_stage(stage):
+            await run_io(update_ingestion_file, job_id, index, self.owner, INGESTION_LEASE, status=stage)
+
+        try:
+            pdf_bytes = await run_io(load_ingestion_file, file_id)
+            entry = await self.pipeline(user_folder, topic, name, pdf_bytes, report_stage)
+            result = {"status": "done", "entry": entry}
+        except DuplicatePaper as e:
+            result = {"status": "duplicate", **e.to_dict()}
+        except Exception as e:
+            print(f"Error processing file {name}: {e}")
+            result = {"status": "failed", "error": str(e)}
+
+        await run_io(update_ingestion_file, job_id, index, self.owner, INGESTION_LEASE, **result)
+        try:
+            await run_io(delete_ingestion_file, file_id)
+        except Exception as e:
+            print(f"Error deleting stored file {name}: {e}")
+        await run_io(finish_ingestion_job_if_complete, job_id, INGESTION_RETENTION)
@@ -1,37 +1,65 @@
-import io
+import asyncio
 import json
 import os
-import re
+import time
 import uuid
-from typing import List, Dict
+from typing import List, Dict, Literal, Optional
 
-import bibtexparser
-import fitz  # PyMuPDF
-import pandas as pd
-import requests
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Request
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 from pydantic import BaseModel
-from transformers import BartTokenizer, BartForConditionalGeneration
 
-from google_drive_helper import authenticate, create_folder, upload_file
-from mongo_db_ops import store_tokens, get_folder_id, update_folder_id, get_user_id, store_oauth_state, \
+from doi_resolver import resolve_doi, metadata_to_paper_info, normalize_doi
+from drive_sync import DriveSync
+from executors import run_cpu, run_io, shutdown_executors
+from google_drive_helper import authenticate, create_folder, upload_stream, invalidate_credentials, \
+    get_user_service
+from model_registry import model_registry
+from mongo_db_ops import store_tokens, get_folder_id, update_folder_id, store_oauth_state, \
     delete_oauth_state, get_oauth_state
+from ingestion_jobs import IngestionJobManager
+from metrics import SERVER_TIMING, http_request_seconds, register_collector, render_metrics, \
+    server_timing_header, start_request_timings, stats_collector, timed
+from paper_fingerprints import DuplicatePaper, find_near_duplicate, minhash_signature, remember_fingerprint, \
+    track_entry_changes
+from pdf_extraction import extract_pdfs, extract_pdf_async, shutdown_extraction_pool
+from search_index import SearchIndexer, search
+from summarizer import get_summary_and_takeaways, summary_scheduler, SUMMARY_INPUT_CHAR_BUDGET
+from topic_query import accepts_encoding, etag_matches, iter_records_json, query_records, records_etag
+from topic_storage import ExcelExporter, InvalidTopicName, XLSX_MIMETYPE, create_topic_storage, \
+    drive_file_storage, records_to_excel
+from topic_write_buffer import TOPIC_WRITE_INTERVAL, TopicWriteBuffer
 
 # Load environment variables from .env file
 load_dotenv()
 
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000/")
 BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:8000")
+# Number of DOIs resolved at the same time by /fetch_by_dois
+DOI_IMPORT_CONCURRENCY = int(os.environ.get("DOI_IMPORT_CONCURRENCY", "8"))
+# Number of files a single user can upload to Drive at the same time
+UPLOAD_CONCURRENCY_PER_USER = int(os.environ.get("UPLOAD_CONCURRENCY_PER_USER", "4"))
+# Load the summarizer in the background at startup instead of on the first summarization
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() == "true"
+# Seconds between checks for progress in /ingest_jobs/{job_id}/events
+INGESTION_EVENTS_INTERVAL = float(os.environ.get("INGESTION_EVENTS_INTERVAL", "1"))
+
+
+def check_topic_names(request: Request):
+    # Every route takes the user folder and topic as query parameters; the local storage builds paths from them
+    try:
+        topic_storage.check_names(request.query_params.get("user_folder"), request.query_params.get("topic"))
+    except InvalidTopicName as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
-app = FastAPI()
+app = FastAPI(dependencies=[Depends(check_topic_names)])
 
 # Ensure CORS middleware is configured before any routes are added
 app.add_middleware(
@@ -40,11 +68,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["ETag", "X-Total-Count", "Server-Timing"],
 )
 
-# Initialize the summarizer
-summarizer_tokenizer = BartTokenizer.from_pretrained('facebook/bart-large-cnn')
-summarizer_model = BartForConditionalGeneration.from_pretrained('facebook/bart-large-cnn')
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = start_request_timings()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # The route template keeps the label set small, e.g. /ingest_jobs/{job_id}
+        route = request.scope.get("route")
+        http_request_seconds.observe(time.perf_counter() - started, request.method,
+                                     route.path if route else "unmatched", status)
+    if SERVER_TIMING and timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
 
 # Set the environment variable to disable HTTPS requirement for local development
 # os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
@@ -67,15 +111,136 @@ CLIENT_CONFIG = {
 }
 
 
+# Primary storage of topic entries, and the .xlsx export kept next to it in Drive
+primary_storage = create_topic_storage()
+excel_exporter = ExcelExporter(primary_storage)
+primary_storage.add_listener(excel_exporter.schedule)
+# Edits to whole-topic storages are serialized and coalesced in memory before they are written
+if primary_storage.buffer_writes and TOPIC_WRITE_INTERVAL > 0:
+    topic_storage = TopicWriteBuffer(primary_storage)
+else:
+    topic_storage = primary_storage
+# Near-duplicate fingerprints are renamed and deleted along with their entries
+topic_storage.add_entry_listener(track_entry_changes)
+# Full-text index of every user's entries, updated in the background after each change
+search_indexer = SearchIndexer(topic_storage)
+primary_storage.add_listener(search_indexer.schedule)
+# Catalog of the users' topic files in Drive, kept current from the Drive changes feed
+drive_storage = drive_file_storage(primary_storage)
+drive_sync = DriveSync(drive_storage) if drive_storage else None
+if drive_sync:
+    drive_storage.catalog = drive_sync
+    primary_storage.add_listener(drive_sync.topic_changed)
+    if drive_storage is primary_storage:
+        # Sheets edited directly in Drive are re-indexed like our own changes
+        drive_sync.add_listener(search_indexer.schedule)
+
+register_collector(stats_collector("inference", summary_scheduler.stats, counters=["batches", "items", "errors"],
+                                   gauges=["queue_depth"]))
+if drive_sync:
+    register_collector(stats_collector("drive_sync", drive_sync.stats,
+                                       counters=["syncs", "full_syncs", "changes", "errors"], gauges=["active_users"]))
+if isinstance(topic_storage, TopicWriteBuffer):
+    register_collector(stats_collector("write_buffer", topic_storage.stats, counters=["flushes", "writes", "errors"],
+                                       gauges=["pending_topics", "pending_writes"]))
+
+# (user_folder, topic) -> asyncio.Lock
+topic_locks = {}
+# user_folder -> asyncio.Semaphore limiting that user's concurrent Drive uploads
+upload_semaphores = {}
+
+
 class DeleteRequest(BaseModel):
     no: int
 
 
+class EntryOperation(BaseModel):
+    op: Literal["update", "delete", "insert"]
+    # Entry to update or delete, numbered as before the batch
+    SL_NO: Optional[int] = None
+    # Fields to set (update) or the new entry (insert)
+    entry: Optional[Dict] = None
+
+
 @app.get("/")
 async def home():
     return "Research AI Backend"
 
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 until the background model warm-up has finished.
+    """
+    status = {"warm_up": MODEL_WARMUP, "models": model_registry.status()}
+    if MODEL_WARMUP and not model_registry.ready():
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+
+@app.on_event("startup")
+async def start_workers():
+    if MODEL_WARMUP:
+        model_registry.warm_up()
+    summary_scheduler.start()
+    await ingestion_jobs.start()
+    if drive_sync:
+        drive_sync.start()
+    # Spreadsheets left out of date by a previous run
+    await run_io(excel_exporter.resume)
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await ingestion_jobs.stop()
+    summary_scheduler.stop(timeout=5)
+    shutdown_extraction_pool()
+    if isinstance(topic_storage, TopicWriteBuffer):
+        topic_storage.flush_all()
+    excel_exporter.flush()
+    search_indexer.stop()
+    if drive_sync:
+        drive_sync.stop(timeout=5)
+    shutdown_executors()
+
+
+@app.get("/inference_stats")
+async def inference_stats():
+    return summary_scheduler.stats()
+
+
+@app.get("/write_buffer_stats")
+async def write_buffer_stats():
+    """
+    How many entry writes were coalesced into each storage write.
+    """
+    if not isinstance(topic_storage, TopicWriteBuffer):
+        return {"enabled": False}
+    return {"enabled": True, **topic_storage.stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Stage, request, MongoDB, Drive and cache metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/flush_topic")
+async def flush_topic(user_folder: str = Query(...), topic: str = Query(...)):
+    """
+    Writes the buffered changes of a topic to its storage right away.
+    """
+    if isinstance(topic_storage, TopicWriteBuffer):
+        try:
+            await run_io(topic_storage.flush, user_folder, topic)
+        except Exception as e:
+            print(f"Error flushing topic: {e}")
+            raise HTTPException(status_code=500, detail="Error flushing topic")
+    return {"message": "Topic flushed"}
+
+
 @app.get("/authorize")
 async def authorize():
     flow = Flow.from_client_config(
@@ -86,7 +251,7 @@ async def authorize():
     state = str(uuid.uuid4())  # Generate unique state for the user
 
     # Store the state in MongoDB
-    store_oauth_state(state, user_email="temp")  # user_email can be updated later if necessary
+    await run_io(store_oauth_state, state, user_email="temp")  # user_email can be updated later if necessary
 
     authorization_url, _ = flow.authorization_url(
         access_type='offline',
@@ -103,7 +268,7 @@ async def oauth2callback(request: Request):
     state = request.query_params.get('state')
 
     # Validate the state to ensure the OAuth flow is legitimate
-    if not get_oauth_state(state):
+    if not await run_io(get_oauth_state, state):
         raise HTTPException(status_code=400, detail="Invalid or expired state")
 
     # Continue with the OAuth flow and fetch the token
@@ -113,11 +278,12 @@ async def oauth2callback(request: Request):
         redirect_uri=REDIRECT_URI
     )
     authorization_response = str(request.url)
-    flow.fetch_token(authorization_response=authorization_response)
+    await run_io(flow.fetch_token, authorization_response=authorization_response)
 
     # Save the credentials and get the user's email from the ID token
     credentials = flow.credentials
-    id_info = id_token.verify_oauth2_token(
+    id_info = await run_io(
+        id_token.verify_oauth2_token,
         id_token=credentials.id_token,
         request=google_requests.Request(),
         audience=os.environ['GOOGLE_CLIENT_ID']
@@ -125,18 +291,19 @@ async def oauth2callback(request: Request):
     user_email = id_info.get('email')
     username = user_email.split('@')[0]
     print(f"User Name: {username}")
-    store_tokens(username, credentials)
+    await run_io(store_tokens, username, credentials)
+    invalidate_credentials(username)
 
     # Check if the folder ID already exists in the database; otherwise, create it
-    folder_id = get_folder_id(username)
+    folder_id = await run_io(get_folder_id, username)
     print(f"Folder ID: {folder_id}")
     if not folder_id:
-        service = authenticate(username)
-        folder_id = create_folder(service, username)
-        update_folder_id(username, folder_id)
+        service = await run_io(authenticate, username)
+        folder_id = await run_io(create_folder, service, username)
+        await run_io(update_folder_id, username, folder_id)
 
     # Delete the state after it's used
-    delete_oauth_state(state)
+    await run_io(delete_oauth_state, state)
 
     # Redirect to the frontend with the user email and folder ID as query parameters
     frontend_url = f"{FRONTEND_URL}?user_email={user_email}&folder_id={folder_id}"
@@ -146,297 +313,386 @@ async def oauth2callback(request: Request):
 @app.get("/fetch_topics")
 async def fetch_topics(user_folder: str = Query(...)):
     try:
-        service = authenticate(get_user_id(user_folder))
-        files = service.files().list(
-            q=f"'{user_folder}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'",
-            spaces='drive',
-            fields='files(id, name)').execute().get('files', [])
-        topics = [file['name'].replace('.xlsx', '') for file in files]
-        return {"topics": topics}
+        return {"topics": await run_io(topic_storage.list_topics, user_folder)}
     except Exception as e:
         print(f"Error while fetching topics: {str(e)}")
         raise HTTPException(status_code=500, detail="Error fetching topics")
 
 
+@app.post("/drive_sync")
+async def sync_drive(user_folder: str = Query(...)):
+    """
+    Pulls the user's Drive changes into the topic catalog now instead of at the next scheduled sync.
+    """
+    if not drive_sync:
+        raise HTTPException(status_code=400, detail="Topics are not stored in Drive")
+    try:
+        return {"changed_topics": await run_io(drive_sync.sync, user_folder)}
+    except Exception as e:
+        print(f"Error syncing Drive changes: {e}")
+        raise HTTPException(status_code=500, detail="Error syncing Drive changes")
+
+
+@app.get("/search")
+async def search_entries(user_folder: str = Query(...), q: str = Query(...), topic: Optional[str] = None,
+                         limit: int = Query(20, ge=1, le=200)):
+    """
+    BM25-ranked entries across the user's topics, matched on NAME, ABSTRACT, SUMMARY, AUTHOR and REMARKS.
+    """
+    try:
+        return await run_io(search, user_folder, q, topic, limit)
+    except Exception as e:
+        print(f"Error searching entries: {e}")
+        raise HTTPException(status_code=500, detail="Error searching entries")
+
+
+@app.post("/search/reindex")
+async def reindex_search(user_folder: str = Query(...)):
+    """
+    Queues every topic of the user for indexing, e.g. topics from before the search index existed.
+    """
+    try:
+        await run_io(search_indexer.schedule_user, user_folder)
+    except Exception as e:
+        print(f"Error reindexing topics: {e}")
+        raise HTTPException(status_code=500, detail="Error reindexing topics")
+    return {"message": "Reindexing started"}
+
+
 @app.post("/upload_pdfs")
 async def upload_pdfs(files: List[UploadFile], user_folder: str, topic: str):
-    service = authenticate(get_user_id(user_folder))
-    for file in files:
-        file_path = f"data/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        upload_file(service, file_path, user_folder)
-    return {"message": "Files uploaded successfully"}
+    """
+    Streams the uploaded files to Drive with resumable uploads, several at a time.
+    Files come straight from the request's spooled upload buffers, nothing is written under data/.
+    """
+    semaphore = upload_semaphores.setdefault(user_folder, asyncio.Semaphore(UPLOAD_CONCURRENCY_PER_USER))
+
+    def upload(file):
+        return upload_stream(get_user_service(user_folder), file.file, file.filename, user_folder,
+                             mimetype=file.content_type or 'application/octet-stream')
+
+    async def upload_with_limit(file):
+        async with semaphore:
+            try:
+                return {"name": file.filename, "id": await run_io(upload, file)}
+            except Exception as e:
+                print(f"Error uploading file {file.filename}: {e}")
+                return {"name": file.filename, "error": str(e)}
+
+    results = await asyncio.gather(*(upload_with_limit(file) for file in files))
+    if any("error" in result for result in results):
+        raise HTTPException(status_code=502, detail={"message": "Some files failed to upload", "files": results})
+    return {"message": "Files uploaded successfully", "files": results}
 
 
 @app.post("/parse_pdfs")
 async def parse_pdfs(files: List[UploadFile] = File(...), user_folder: str = Query(...), topic: str = Query(...)):
-    responses = []
-    for file in files:
+    """
+    Parses PDFs into the topic. Returns one result per file with status "added" (and the entry),
+    "duplicate" (with the entry it duplicates and the similarity) or "failed".
+    """
+    async def ingest(filename, extraction):
         try:
-            # Read the uploaded file into memory
-            pdf_buffer = io.BytesIO(await file.read())
-
-            # Process the PDF content from the in-memory buffer
-            paper_info = parse_pdf_details(pdf_buffer)
-            full_text = extract_full_text(pdf_buffer)
-            paper_info["SUMMARY"], paper_info["KEY_TAKEAWAYS"] = get_summary_and_takeaways(full_text)
-
-            # Check for existing data
-            existing_data = load_existing_data(user_folder, topic)
-            if any(entry['DOI'] == paper_info['DOI'] for entry in existing_data):
-                continue  # Skip existing DOIs
-
-            # Add SL_NO
-            paper_info["SL_NO"] = len(existing_data) + 1
-
-            # Save the new data
-            existing_data.append(paper_info)
-
-            # Save to Excel in memory
-            excel_buffer = io.BytesIO()
-            df = pd.DataFrame(existing_data)
-            with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                df.to_excel(writer, index=False)
-            excel_buffer.seek(0)
-
-            # Upload to Google Drive
-            service = authenticate(get_user_id(user_folder))
-            file_metadata = {'name': f'{topic}.xlsx', 'parents': [user_folder]}
-            media_body = MediaIoBaseUpload(excel_buffer,
-                                           mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-
-            # Check if file already exists in Google Drive
-            files_in_drive = service.files().list(q=f"'{user_folder}' in parents and name='{topic}.xlsx'",
-                                                  spaces='drive', fields='files(id, name)').execute().get('files', [])
-            if files_in_drive:
-                file_id = files_in_drive[0]['id']
-                service.files().update(fileId=file_id, media_body=media_body).execute()
-            else:
-                service.files().create(body=file_metadata, media_body=media_body).execute()
-
-            responses.append(paper_info)
+            if isinstance(extraction, Exception):
+                raise extraction
+            entry = await ingest_extracted_pdf(extraction, user_folder, topic)
+            return {"filename": filename, "status": "added", "entry": entry}
+        except DuplicatePaper as e:
+            return {"filename": filename, "status": "duplicate", **e.to_dict()}
         except Exception as e:
-            print(f"Error processing file {file.filename}: {e}")
-    return responses
+            print(f"Error processing file {filename}: {e}")
+            return {"filename": filename, "status": "failed", "error": str(e)}
+
+    # Read the uploaded files into memory and extract them in parallel worker processes.
+    # Each file moves on to DOI resolution and summarization as soon as it is extracted,
+    # so the summaries of a batch end up in the same inference batches.
+    named_pdfs = [(file.filename, await file.read()) for file in files]
+    tasks = []
+    async for filename, extraction in extract_pdfs(named_pdfs, max_text_chars=SUMMARY_INPUT_CHAR_BUDGET):
+        tasks.append(asyncio.create_task(ingest(filename, extraction)))
+    return await asyncio.gather(*tasks)
+
+
+@app.post("/ingest_pdfs")
+async def ingest_pdfs(files: List[UploadFile] = File(...), user_folder: str = Query(...), topic: str = Query(...)):
+    """
+    Starts a background ingestion job for the PDFs and returns its id right away.
+    Progress is available from /ingest_jobs/{job_id} and /ingest_jobs/{job_id}/events.
+    """
+    named_pdfs = [(file.filename, await file.read()) for file in files]
+    job_id = await ingestion_jobs.submit(user_folder, topic, named_pdfs)
+    return {"job_id": job_id}
+
+
+@app.get("/ingest_jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = await ingestion_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/ingest_jobs/{job_id}/events")
+async def ingest_job_events(job_id: str):
+    """
+    Server-Sent Events stream of the job, sending the full job state every time it changes.
+    """
+    async def event_stream():
+        last_payload = None
+        while True:
+            job = await ingestion_jobs.get_job(job_id)
+            if not job:
+                yield "event: error\ndata: {\"detail\": \"Job not found\"}\n\n"
+                return
+            payload = json.dumps(job, default=str)
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+            if job["status"] == "done":
+                return
+            await asyncio.sleep(INGESTION_EVENTS_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 @app.post("/fetch_by_dois")
 async def fetch_by_dois(dois: List[str], user_folder: str = Query(...), topic: str = Query(...)):
-    responses = []
-    existing_data = load_existing_data(user_folder, topic)
+    """
+    Bulk-imports DOIs into a topic. DOIs are resolved concurrently and the topic is written once.
+    Returns one result per input DOI with status "added", "duplicate" or "unresolvable".
+    """
+    existing_data = await run_io(load_existing_data, user_folder, topic)
+    known_dois = {normalize_doi(str(entry['DOI'])) for entry in existing_data}
+
+    # Skip DOIs already in the topic or repeated in the request before resolving anything
+    to_resolve = []
+    requested = set()
     for doi in dois:
-        if any(entry['DOI'] == doi for entry in existing_data):
-            continue  # Skip existing DOIs
+        key = normalize_doi(doi)
+        if key and key not in known_dois and key not in requested:
+            requested.add(key)
+            to_resolve.append(doi)
 
-        bibtex_data = get_doi_bibtex(doi)
-        if not bibtex_data:
-            continue
+    semaphore = asyncio.Semaphore(DOI_IMPORT_CONCURRENCY)
 
-        metadata = bibtex_to_json(bibtex_data)[0]
-        paper_info = {
-            "NAME": metadata.get("title", "Unknown"),
-            "YEAR": metadata.get("year", "Unknown"),
-            "PUBLICATION": metadata.get("journal", "Unknown"),
-            "PAGE_NO": metadata.get("pages", "Unknown"),
-            "ABSTRACT": metadata.get("abstract", "Unknown"),
-            "DOI": metadata.get("doi", "Unknown"),
-            "AUTHOR": metadata.get("author", "Unknown"),
-            "REMARKS": ""
-        }
+    async def resolve(doi):
+        async with semaphore:
+            return await run_io(resolve_doi, doi)
 
-        # Add SL_NO
-        paper_info["SL_NO"] = len(existing_data) + 1
+    resolved = dict(zip(to_resolve, await asyncio.gather(*(resolve(doi) for doi in to_resolve))))
 
-        # Save the new data
-        existing_data.append(paper_info)
-        save_to_excel(existing_data, user_folder, topic)
+    results = []
+    new_entries = []
+    for doi in dois:
+        if doi not in resolved:
+            status = "duplicate" if normalize_doi(doi) else "unresolvable"
+            results.append({"doi": doi, "status": status})
+            continue
+        metadata = resolved.pop(doi)
+        if not metadata:
+            results.append({"doi": doi, "status": "unresolvable"})
+            continue
 
-        responses.append(paper_info)
-    return responses
+        paper_info = metadata_to_paper_info(metadata)
+        # The resolved DOI can differ from the requested one (e.g. a redirect to the canonical DOI)
+        key = normalize_doi(str(paper_info["DOI"]))
+        if key in known_dois:
+            results.append({"doi": doi, "status": "duplicate"})
+            continue
+        known_dois.add(key)
+        new_entries.append({"doi": doi, "status": "added", "entry": paper_info})
+        results.append(new_entries[-1])
+
+    if new_entries:
+        async with get_topic_lock(user_folder, topic):
+            # Another import may have added some of the papers while they were being resolved
+            existing_data = await run_io(load_existing_data, user_folder, topic)
+            known_dois = {normalize_doi(str(entry['DOI'])) for entry in existing_data}
+            to_add = []
+            for result in new_entries:
+                if normalize_doi(str(result["entry"]["DOI"])) in known_dois:
+                    result["status"] = "duplicate"
+                    del result["entry"]
+                else:
+                    to_add.append(result)
+            # The storage numbers the entries when it appends them, in input order
+            added = await run_io(topic_storage.add_entries, user_folder, topic,
+                                 [result["entry"] for result in to_add])
+            for result, entry in zip(to_add, added):
+                result["entry"] = entry
+    return results
 
 
 @app.post("/update_entry")
 async def update_entry(entry: Dict, user_folder: str = Query(...), topic: str = Query(...)):
     try:
-        existing_data = load_existing_data(user_folder, topic)
-        for index, item in enumerate(existing_data):
-            if item["SL_NO"] == entry["SL_NO"]:
-                existing_data[index].update(entry)
-                save_to_excel(existing_data, user_folder, topic)
-                return {"message": "Entry updated successfully"}
-        raise HTTPException(status_code=404, detail="Entry not found")
+        updated = await run_io(topic_storage.update_entry, user_folder, topic, entry)
     except Exception as e:
         print(f"Error while updating entry: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    if not updated:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    return {"message": "Entry updated successfully"}
+
+
+@app.post("/batch_entries")
+async def batch_entries(operations: List[EntryOperation], user_folder: str = Query(...), topic: str = Query(...)):
+    """
+    Applies an ordered list of update, delete and insert operations to a topic with one load and one write.
+    SL_NOs refer to the entries before the batch; the topic is renumbered once at the end.
+    Returns one outcome per operation with status "ok" or "not_found" and the entry's final SL_NO.
+    """
+    for index, operation in enumerate(operations):
+        if operation.op != "insert" and operation.SL_NO is None:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: {operation.op} needs an SL_NO")
+        if operation.op != "delete" and operation.entry is None:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: {operation.op} needs an entry")
+    try:
+        return await run_io(topic_storage.apply_batch, user_folder, topic,
+                            [operation.dict() for operation in operations])
+    except Exception as e:
+        print(f"Error while applying batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/existing_data")
-def get_existing_data(user_folder: str = Query(...), topic: str = Query(...)):
+async def get_existing_data(request: Request, user_folder: str = Query(...), topic: str = Query(...),
+                            offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=0),
+                            fields: Optional[str] = None, sort: Optional[str] = None, year: Optional[str] = None,
+                            publication: Optional[str] = None, author: Optional[str] = None):
+    """
+    Entries of a topic as a JSON list, optionally filtered (year, publication, author), sorted
+    (`sort=YEAR`, `sort=-YEAR`), paged (offset, limit) and projected (`fields=NAME,YEAR`).
+    X-Total-Count has the number of matching entries; If-None-Match with the ETag answers 304 when
+    the topic didn't change.
+    """
+    query = (offset, limit, fields, sort, year, publication, author)
     try:
-        existing_data = load_existing_data(user_folder, topic)
-        return existing_data
+        # One lookup of the topic serves both the ETag and, unless it matches, the load
+        revision, load = await run_io(topic_storage.open_topic, user_folder, topic)
+        etag = records_etag(revision, *query)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+        existing_data = await run_io(load)
+        total, existing_data = query_records(existing_data, year=year, publication=publication, author=author,
+                                             sort=sort, offset=offset, limit=limit, fields=fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error loading existing data: {e}")
         raise HTTPException(status_code=500, detail="Error loading existing data")
 
+    headers["X-Total-Count"] = str(total)
+    gzip = accepts_encoding(request.headers.get("accept-encoding"), "gzip")
+    headers["Vary"] = "Accept-Encoding"
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(iter_records_json(existing_data, gzip=gzip), media_type="application/json",
+                             headers=headers)
+
+
+@app.get("/export_topic")
+async def export_topic(user_folder: str = Query(...), topic: str = Query(...)):
+    """
+    Downloads the topic as an .xlsx spreadsheet built from the primary storage.
+    """
+    try:
+        existing_data = await run_io(load_existing_data, user_folder, topic)
+        content = await run_cpu(records_to_excel, existing_data)
+    except Exception as e:
+        print(f"Error exporting topic: {e}")
+        raise HTTPException(status_code=500, detail="Error exporting topic")
+    return Response(content=content, media_type=XLSX_MIMETYPE,
+                    headers={"Content-Disposition": f'attachment; filename="{topic}.xlsx"'})
+
 
 @app.delete("/delete_entry")
 async def delete_entry(request: DeleteRequest, user_folder: str = Query(...), topic: str = Query(...)):
     try:
-        existing_data = load_existing_data(user_folder, topic)
-        updated_data = [entry for entry in existing_data if entry["SL_NO"] != request.no]
-
-        # Reindex SL_NO
-        for i, entry in enumerate(updated_data):
-            entry["SL_NO"] = i + 1
-
-        if not updated_data:
-            updated_data = pd.DataFrame(
-                columns=["SL_NO", "NAME", "YEAR", "PUBLICATION", "PAGE_NO", "SUMMARY", "ABSTRACT", "DOI", "AUTHOR",
-                         "REMARKS"])
-        save_to_excel(updated_data, user_folder, topic)
+        # Renumbers the entries after the deleted one
+        await run_io(topic_storage.delete_entry, user_folder, topic, request.no)
         return {"message": "Entry deleted successfully"}
     except Exception as e:
         print(f"Error while deleting: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def parse_pdf_details(file_stream):
-    file_stream.seek(0)  # Reset the stream to the beginning
-    with fitz.open(stream=file_stream, filetype="pdf") as pdf_reader:
-        text = ""
-        for page_num in range(pdf_reader.page_count):
-            page = pdf_reader.load_page(page_num)
-            text += page.get_text()
-
-    doi = extract_doi(text)
-    bibtex_data = get_doi_bibtex(doi)
-    metadata = bibtex_to_json(bibtex_data)[0]
-
-    return {
-        "NAME": metadata.get("title", "Unknown"),
-        "YEAR": metadata.get("year", "Unknown"),
-        "PUBLICATION": metadata.get("journal", "Unknown"),
-        "PAGE_NO": metadata.get("pages", "Unknown"),
-        "ABSTRACT": metadata.get("abstract", "Unknown"),
-        "DOI": metadata.get("doi", "Unknown"),
-        "AUTHOR": metadata.get("author", "Unknown"),
-        "REMARKS": ""
-    }
+@timed("parse_pdf_details")
+def parse_pdf_details(extraction):
+    metadata = resolve_doi(extraction.doi) or {}
+    paper_info = metadata_to_paper_info(metadata)
+    if paper_info["NAME"] == "Unknown" and extraction.title:
+        paper_info["NAME"] = extraction.title
+    return paper_info
+
+
+def check_duplicate(paper_info, signature, user_folder, topic, existing_data):
+    """
+    Raises DuplicatePaper if the topic already has the paper: the same DOI, or, for any paper,
+    text similar enough to one ingested before.
+    """
+    doi = normalize_doi(str(paper_info['DOI']))
+    # Papers without a DOI are all "Unknown" and can only be told apart by their text
+    if doi and doi != "unknown":
+        for entry in existing_data:
+            if normalize_doi(str(entry['DOI'])) == doi:
+                raise DuplicatePaper("doi", entry)
+    match = find_near_duplicate(user_folder, topic, signature, existing_data)
+    if match:
+        raise DuplicatePaper("text", *match)
 
 
-def extract_full_text(file_stream):
-    file_stream.seek(0)  # Reset the stream to the beginning
-    text = ""
-    with fitz.open(stream=file_stream, filetype="pdf") as pdf_reader:
-        for page_num in range(pdf_reader.page_count):
-            page = pdf_reader.load_page(page_num)
-            text += page.get_text()
-    return text
+def get_topic_lock(user_folder, topic):
+    # Serializes the load -> append -> save of concurrent ingestions into the same topic
+    return topic_locks.setdefault((user_folder, topic), asyncio.Lock())
 
 
-def extract_doi(text):
-    doi_pattern = re.compile(r'\b10\.\d{4,9}/[-._;()/:A-Z0-9]+\b', re.IGNORECASE)
-    match = doi_pattern.search(text)
-    if match:
-        return match.group(0).strip()
-    return "Unknown"
+async def ingest_extracted_pdf(extraction, user_folder, topic, report_stage=None):
+    """
+    Resolves, summarizes and saves one extracted PDF.
+    Returns the new entry, or raises DuplicatePaper if the paper is already in the topic.
+    """
+    async def stage(name):
+        if report_stage:
+            await report_stage(name)
 
+    await stage("resolving")
+    paper_info = await run_io(parse_pdf_details, extraction)
+    signature = await run_cpu(minhash_signature, extraction.text, extraction.title)
 
-def get_doi_bibtex(doi):
-    base_url = f"https://doi.org/{doi}"
-    headers = {
-        "Accept": "text/bibliography; style=bibtex"
-    }
-    response = requests.get(base_url, headers=headers)
-    if response.status_code == 200:
-        bibtex_str = response.text.strip()
-        bibtex_str = bibtex_str.encode('latin1', errors='ignore').decode('utf-8',
-                                                                         errors='ignore')  # Decode using Latin-1, then re-encode as UTF-8
-        return bibtex_str
-    else:
-        return None
+    # Known papers are skipped before they cost an inference
+    existing_data = await run_io(load_existing_data, user_folder, topic)
+    await run_io(check_duplicate, paper_info, signature, user_folder, topic, existing_data)
+
+    await stage("summarizing")
+    paper_info["SUMMARY"], paper_info["KEY_TAKEAWAYS"] = await get_summary_and_takeaways(extraction.text)
+
+    await stage("persisting")
+    async with get_topic_lock(user_folder, topic):
+        # Check again, another upload may have added the paper while it was being summarized
+        existing_data = await run_io(load_existing_data, user_folder, topic)
+        await run_io(check_duplicate, paper_info, signature, user_folder, topic, existing_data)
 
+        # Save the new data; the storage assigns the SL_NO
+        [paper_info] = await run_io(topic_storage.add_entries, user_folder, topic, [paper_info])
+        await run_io(remember_fingerprint, user_folder, topic, paper_info, signature)
+    return paper_info
 
-def bibtex_to_json(bibtex_str):
-    bib_database = bibtexparser.loads(bibtex_str)
-    return json.loads(json.dumps(bib_database.entries))
 
+async def run_ingestion_pipeline(user_folder, topic, filename, pdf_bytes, report_stage):
+    await report_stage("extracting")
+    extraction = await extract_pdf_async(pdf_bytes, max_text_chars=SUMMARY_INPUT_CHAR_BUDGET)
+    return await ingest_extracted_pdf(extraction, user_folder, topic, report_stage)
 
-def get_summary_and_takeaways(text):
-    inputs = summarizer_tokenizer.batch_encode_plus([text], max_length=1024, return_tensors='pt', truncation=True)
-    summary_ids = summarizer_model.generate(inputs['input_ids'], num_beams=4, max_length=150, early_stopping=True)
-    summary = summarizer_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-    key_takeaways = summary  # For simplicity, using the summary as key takeaways
-    return summary, key_takeaways
 
+ingestion_jobs = IngestionJobManager(run_ingestion_pipeline)
 
+
+@timed("load_existing_data")
 def load_existing_data(user_folder, topic):
-    service = authenticate(get_user_id(user_folder))
-    files = service.files().list(q=f"'{user_folder}' in parents and name = '{topic}.xlsx'", spaces='drive',
-                                 fields='files(id, name)').execute().get('files', [])
-
-    if not files:
-        # If no file exists, return an empty list
-        return []
-
-    # Get the file ID and download it directly into memory
-    file_id = files[0]['id']
-    request = service.files().get_media(fileId=file_id)
-
-    # Create an in-memory buffer to store the file
-    file_stream = io.BytesIO()
-    downloader = MediaIoBaseDownload(file_stream, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        print(f"Download {int(status.progress() * 100)}%.")
-
-    # Move the pointer to the start of the file
-    file_stream.seek(0)
-
-    # Load the Excel file into a pandas DataFrame directly from memory
-    try:
-        df = pd.read_excel(file_stream)
-        df = df.fillna("")  # Handle any missing values
-        return df.to_dict(orient='records')
-    except Exception as e:
-        print(f"Error loading Excel data: {e}")
-        return []
-
-
-def save_to_excel(data, user_folder, topic):
-    # Create the Excel file in-memory using a BytesIO buffer
-    excel_buffer = io.BytesIO()
-    df = pd.DataFrame(data)
-    columns_order = ["SL_NO", "NAME", "YEAR", "PUBLICATION", "PAGE_NO", "SUMMARY", "ABSTRACT", "DOI", "AUTHOR",
-                     "REMARKS"]
-    df = df[columns_order]
-
-    # Save the DataFrame to the in-memory Excel file
-    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    excel_buffer.seek(0)
-
-    # Authenticate and get the Google Drive service
-    service = authenticate(get_user_id(user_folder))
-
-    # Prepare file metadata and media body for Google Drive upload
-    file_metadata = {'name': f'{topic}.xlsx', 'parents': [user_folder]}
-    media_body = MediaIoBaseUpload(excel_buffer,
-                                   mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-
-    # Check if the file already exists in Google Drive
-    files_in_drive = service.files().list(q=f"'{user_folder}' in parents and name='{topic}.xlsx'", spaces='drive',
-                                          fields='files(id, name)').execute().get('files', [])
-
-    # If the file exists, update it; otherwise, create a new one
-    if files_in_drive:
-        file_id = files_in_drive[0]['id']
-        service.files().update(fileId=file_id, media_body=media_body).execute()
-    else:
-        service.files().create(body=file_metadata, media_body=media_body).execute()
+    return topic_storage.load(user_folder, topic)
 
 
 if __name__ == '__main__':
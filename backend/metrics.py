@@ -0,0 +1,235 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+
+from pymongo import monitoring
+
+from cache_utils import all_caches
+
+METRICS_PREFIX = "researchai"
+# Seconds; covers everything from a cache lookup to a full summarization
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Return a Server-Timing header with the per-stage breakdown of every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+
+# Stage -> [total seconds, count] of the request being handled; shared with the threads it runs work in
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts, sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total, count = self._values.get(label_values) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[label_values] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels + ("le",), label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+stage_seconds = Histogram("stage_seconds", "Time spent in each processing stage.", ["stage"])
+stage_errors = Counter("stage_errors_total", "Processing stages that raised an exception.", ["stage"])
+http_request_seconds = Histogram("http_request_seconds", "HTTP request latency by route.",
+                                 ["method", "route", "status"])
+mongo_command_seconds = Histogram("mongo_command_seconds", "MongoDB command latency.", ["command"])
+mongo_command_errors = Counter("mongo_command_errors_total", "Failed MongoDB commands.", ["command"])
+drive_bytes = Counter("drive_bytes_total", "Bytes transferred to and from Google Drive.", ["direction"])
+
+_metrics = [stage_seconds, stage_errors, http_request_seconds, mongo_command_seconds, mongo_command_errors,
+            drive_bytes]
+# Functions called at scrape time that return Prometheus text lines, e.g. for gauges of queue depths
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def stats_collector(name, stats_fn, counters=(), gauges=()):
+    """
+    Collector exposing numeric fields of an existing stats() dict, e.g. the inference scheduler's.
+    """
+    def collect():
+        stats = stats_fn()
+        lines = []
+        for keys, metric_type, suffix in ((counters, "counter", "_total"), (gauges, "gauge", "")):
+            for key in keys:
+                metric = f"{METRICS_PREFIX}_{name}_{key}{suffix}"
+                lines += [f"# TYPE {metric} {metric_type}", f"{metric} {stats[key]}"]
+        return lines
+    return collect
+
+
+def _record_request_timing(stage, seconds):
+    timings = _request_timings.get()
+    if timings is not None:
+        with _timings_lock:
+            total = timings.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+
+def record_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    _record_request_timing(stage, seconds)
+
+
+@contextlib.contextmanager
+def span(stage):
+    """
+    Times the enclosed block as `stage`, in the stage histogram and the current request's breakdown.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        stage_errors.inc(stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """
+    Decorator version of `span`, for functions and coroutine functions.
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request_timings():
+    """
+    Starts collecting the stage breakdown of the current request. Returns the dict it is collected in.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings):
+    with _timings_lock:
+        return ", ".join(f"{stage.replace('.', '_')};dur={total * 1000:.1f};desc=\"{count}x\""
+                         for stage, (total, count) in sorted(timings.items()))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener feeding the MongoDB latency histogram and the request breakdown.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_seconds.observe(seconds, event.command_name)
+        _record_request_timing("mongo", seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_seconds.observe(seconds, event.command_name)
+        mongo_command_errors.inc(event.command_name)
+        _record_request_timing("mongo", seconds)
+
+
+def _cache_lines():
+    # Caches with the same name (e.g. the per-thread Drive service caches) are reported together
+    totals = {}
+    for cache in list(all_caches):
+        stats = cache.stats()
+        total = totals.setdefault(stats["name"], {"hits": 0, "misses": 0, "entries": 0, "size": 0})
+        for key in total:
+            total[key] += stats[key]
+
+    lines = []
+    for metric, metric_type, key, documentation in (
+            ("cache_hits_total", "counter", "hits", "Cache lookups that found an entry."),
+            ("cache_misses_total", "counter", "misses", "Cache lookups that found nothing."),
+            ("cache_entries", "gauge", "entries", "Entries currently cached."),
+            ("cache_size", "gauge", "size", "Current size of the cache, in its own unit.")):
+        name = f"{METRICS_PREFIX}_{metric}"
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+        lines += [f'{name}{{cache="{cache_name}"}} {total[key]}' for cache_name, total in sorted(totals.items())]
+    return lines
+
+
+def render_metrics():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    lines += _cache_lines()
+    for collector in _collectors:
+        try:
+            lines += collector()
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    return "\n".join(lines) + "\n"
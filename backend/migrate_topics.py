@@ -0,0 +1,54 @@
+"""
+Converts existing topic spreadsheets (.xlsx in Drive) to another topic storage backend.
+
+Run from the backend directory:
+
+    python migrate_topics.py --to drive_jsonl                 # every user in folder_mapping
+    python migrate_topics.py --to local_jsonl --user-folder <folder_id> --topic <topic>
+
+The .xlsx files are left in place; they become the Excel export of the new storage.
+"""
+import argparse
+
+from mongo_db_ops import db
+from topic_storage import STORAGE_BACKENDS, DriveExcelStorage, create_topic_storage
+
+
+def migrate_topic(source, target, user_folder, topic, overwrite=False):
+    if not overwrite and target.exists(user_folder, topic):
+        return "skipped"
+    # Not `load`: a spreadsheet that can't be parsed must fail the topic, not migrate it as empty and
+    # have the Excel export overwrite it
+    target.save(source.read(user_folder, topic), user_folder, topic)
+    return "migrated"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, choices=[name for name in STORAGE_BACKENDS if name != "drive_xlsx"],
+                        help="Target storage backend")
+    parser.add_argument("--user-folder", action="append", help="Only migrate this user folder (repeatable)")
+    parser.add_argument("--topic", action="append", help="Only migrate this topic (repeatable)")
+    parser.add_argument("--overwrite", action="store_true", help="Replace topics that already exist in the target")
+    args = parser.parse_args()
+
+    source = DriveExcelStorage()
+    target = create_topic_storage(args.to)
+    user_folders = args.user_folder or [mapping["folder_id"]
+                                        for mapping in db.folder_mapping.find({}, {"folder_id": 1})]
+
+    counts = {"migrated": 0, "skipped": 0, "failed": 0}
+    for user_folder in user_folders:
+        for topic in args.topic or source.list_topics(user_folder):
+            try:
+                status = migrate_topic(source, target, user_folder, topic, args.overwrite)
+            except Exception as e:
+                print(f"Error migrating {user_folder}/{topic}: {e}")
+                status = "failed"
+            counts[status] += 1
+            print(f"{status}: {user_folder}/{topic}")
+    print(f"Done: {counts['migrated']} migrated, {counts['skipped']} skipped, {counts['failed']} failed")
+
+
+if __name__ == '__main__':
+    main()
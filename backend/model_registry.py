@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Loads models on first use instead of at import time.
+
+    Every model is registered with a loader function; `get` calls it once, in whichever thread
+    needs the model first, and returns the same object afterwards. `warm_up` loads models in a
+    background thread so readiness probes can report when they are available.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._status = {}
+        self._lock = threading.Lock()
+        self._model_locks = {}
+        self._warm_up_thread = None
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._model_locks[name] = threading.Lock()
+            self._status[name] = {"state": "not_loaded"}
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._model_locks[name]:
+            # Another thread may have finished loading while we waited
+            if name in self._models:
+                return self._models[name]
+            self._set_status(name, state="loading")
+            started = time.monotonic()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                self._set_status(name, state="failed", error=str(e))
+                raise
+            self._models[name] = model
+            self._set_status(name, state="ready", load_seconds=round(time.monotonic() - started, 2))
+            return model
+
+    def set(self, name, model):
+        """
+        Installs an already built model, e.g. a stand-in for tests and benchmarks.
+        """
+        with self._lock:
+            self._models[name] = model
+            self._status[name] = {"state": "ready"}
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def warm_up(self, names=None):
+        """
+        Loads the given models (all registered ones by default) in a background thread.
+        """
+        names = list(names or self._loaders)
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Error loading model {name}: {e}")
+
+        with self._lock:
+            if self._warm_up_thread and self._warm_up_thread.is_alive():
+                return
+            self._warm_up_thread = threading.Thread(target=load_all, name="model-warm-up", daemon=True)
+            self._warm_up_thread.start()
+
+    def ready(self, names=None):
+        return all(self.is_loaded(name) for name in (names or self._loaders))
+
+    def status(self):
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+    def _set_status(self, name, **status):
+        with self._lock:
+            self._status[name] = status
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,185 @@
+"""
+Model server: runs the summarizer in one process and serves it to any number of uvicorn workers over
+a Unix socket, so each worker only keeps the tokenizer instead of its own copy of BART.
+
+    python model_server.py --socket /tmp/researchai-model.sock
+
+Workers started with SUMMARIZER_SERVER_SOCKET set to the same path send their batches here; batches
+from all workers are merged by this process's inference scheduler. serve.py starts both.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+# Unix socket of the model server; when set, this process sends summarization batches there instead of
+# loading the model itself
+SUMMARIZER_SERVER_SOCKET = os.environ.get("SUMMARIZER_SERVER_SOCKET", "")
+DEFAULT_SOCKET = "/tmp/researchai-model.sock"
+# Seconds to wait for the model server to load the model, and for a single batch
+MODEL_SERVER_TIMEOUT = float(os.environ.get("MODEL_SERVER_TIMEOUT", "600"))
+
+_LENGTH = struct.Struct("!I")
+
+
+def send_message(stream, message):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+def recv_message(stream):
+    """
+    Reads one length-prefixed JSON message, or returns None if the other side closed the connection.
+    """
+    header = stream.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data)
+
+
+class ModelServerError(Exception):
+    pass
+
+
+class ModelServerClient:
+    """
+    Connection to the model server, shared by the threads of a worker; requests are sent one at a time
+    and a broken connection is reopened on the next request.
+    """
+
+    def __init__(self, path=SUMMARIZER_SERVER_SOCKET, timeout=MODEL_SERVER_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock.makefile("rwb")
+
+    def _close(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+            self._stream = None
+
+    def request(self, message):
+        with self._lock:
+            try:
+                if self._stream is None:
+                    self._stream = self._connect()
+                send_message(self._stream, message)
+                response = recv_message(self._stream)
+            except OSError:
+                self._close()
+                raise
+            if response is None:
+                self._close()
+                raise ModelServerError("Model server closed the connection")
+        if "error" in response:
+            raise ModelServerError(response["error"])
+        return response
+
+    def status(self):
+        return self.request({"op": "status"})
+
+    def summarize(self, token_sections):
+        return self.request({"op": "summarize", "sections": token_sections})["summaries"]
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits until the server is up and has loaded its model. Returns its status.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            try:
+                status = self.status()
+                if status["ready"]:
+                    return status
+            except (OSError, ModelServerError) as e:
+                if time.monotonic() >= deadline:
+                    raise ModelServerError(f"Model server at {self.path} is not reachable: {e}")
+            if time.monotonic() >= deadline:
+                raise ModelServerError(f"Model server at {self.path} did not load its model in time")
+            time.sleep(0.5)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def serve(path):
+    # Imported here: this module is also imported by summarizer, as the client side
+    from model_registry import model_registry
+    from summarizer import SUMMARIZER_CONFIG_ID, summary_scheduler
+
+    def handle(message):
+        if message.get("op") == "status":
+            return {"ready": model_registry.ready(), "config_id": SUMMARIZER_CONFIG_ID,
+                    "models": model_registry.status(), "scheduler": summary_scheduler.stats()}
+        if message.get("op") == "summarize":
+            # Queued together with the batches of the other workers
+            futures = summary_scheduler.submit_many(message["sections"])
+            return {"summaries": [future.result() for future in futures]}
+        return {"error": f"Unknown op {message.get('op')}"}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                message = recv_message(self.rfile)
+                if message is None:
+                    return
+                try:
+                    response = handle(message)
+                except Exception as e:
+                    print(f"Error handling model server request: {e}")
+                    response = {"error": str(e)}
+                send_message(self.wfile, response)
+
+    # A socket file left behind by a previous run
+    if os.path.exists(path):
+        os.unlink(path)
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    # Shut down cleanly when the launcher terminates us
+    signal.signal(signal.SIGTERM, stop)
+
+    model_registry.warm_up()
+    summary_scheduler.start()
+    print(f"Model server listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        summary_scheduler.stop(timeout=5)
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=SUMMARIZER_SERVER_SOCKET or DEFAULT_SOCKET, help="Unix socket to serve on")
+    args = parser.parse_args()
+    # This process runs the model: summarizer must not forward its batches to the socket
+    os.environ.pop("SUMMARIZER_SERVER_SOCKET", None)
+    serve(args.socket)
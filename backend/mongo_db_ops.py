@@ -1,18 +1,26 @@
 import datetime
 import os
 
+import gridfs
 from dotenv import load_dotenv
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from pymongo import MongoClient
+from pymongo import DeleteOne, InsertOne, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from cache_utils import LRUCache
 from crypto_ops import encrypt_token, decrypt_token
+from metrics import MongoCommandMetrics
 
 load_dotenv()
 
 # Initialize MongoDB client
-client = MongoClient(os.getenv("MONGO_URI"))
+client = MongoClient(os.getenv("MONGO_URI"), event_listeners=[MongoCommandMetrics()])
 db = client.research_ai
 
+# Folder IDs map to a single user and never change, so lookups are kept in memory
+_folder_user_cache = LRUCache(int(os.getenv("FOLDER_USER_CACHE_SIZE", "4096")), name="folder_user")
+
 # =================== TOKEN OPERATIONS ===================
 def store_tokens(user_name, credentials):
     print(f"Storing token for {user_name}")
@@ -68,8 +76,12 @@ def get_folder_id(user_email):
     return None
 
 def get_user_id(folder_id):
+    user_email = _folder_user_cache.get(folder_id)
+    if user_email:
+        return user_email
     folder_data = db.folder_mapping.find_one({"folder_id": folder_id})
     if folder_data:
+        _folder_user_cache.set(folder_id, folder_data["user_email"])
         return folder_data["user_email"]
     return None
 
@@ -79,6 +91,7 @@ def update_folder_id(user_email, folder_id):
         {"$set": {"folder_id": folder_id}},
         upsert=True
     )
+    _folder_user_cache.set(folder_id, user_email)
     print(f"Folder ID updated for user: {user_email}")
 
 # =================== OAUTH STATE OPERATIONS ===================
@@ -116,3 +129,394 @@ def delete_oauth_state(state):
     """
     db.oauth_states.delete_one({"state": state})
     print(f"OAuth state deleted for state: {state}")
+
+# =================== DOI CACHE OPERATIONS ===================
+def ensure_doi_cache_indexes():
+    """
+    Creates the unique DOI index and the TTL index that lets MongoDB drop expired entries.
+    """
+    db.doi_cache.create_index("doi", unique=True)
+    db.doi_cache.create_index("expires_at", expireAfterSeconds=0)
+
+def get_cached_doi(doi):
+    """
+    Returns the cached entry for a DOI, or None if it is missing or expired.
+    A cached entry with metadata None records a DOI that failed to resolve.
+    """
+    doi_data = db.doi_cache.find_one({"doi": doi}, {"_id": 0})
+    # MongoDB only removes expired documents once a minute, so check the expiry here as well
+    if not doi_data or doi_data["expires_at"] < datetime.datetime.utcnow():
+        return None
+    return doi_data
+
+def store_cached_doi(doi, bibtex, metadata, ttl):
+    """
+    Stores a resolved (or unresolvable, with metadata None) DOI for `ttl` (a timedelta).
+    """
+    db.doi_cache.update_one(
+        {"doi": doi},
+        {"$set": {
+            "doi": doi,
+            "bibtex": bibtex,
+            "metadata": metadata,
+            "expires_at": datetime.datetime.utcnow() + ttl
+        }},
+        upsert=True
+    )
+
+# =================== INGESTION JOB OPERATIONS ===================
+# Uploaded PDFs are kept in GridFS until their job has processed them, so a restart can resume
+ingestion_files = gridfs.GridFS(db, collection="ingestion_files")
+INGESTION_TERMINAL_STATUSES = ["done", "duplicate", "failed"]
+
+def ensure_ingestion_job_indexes():
+    db.ingestion_jobs.create_index("job_id", unique=True)
+    db.ingestion_jobs.create_index([("status", 1), ("lease_until", 1)])
+    # Finished jobs are removed once their expires_at has passed
+    db.ingestion_jobs.create_index("expires_at", expireAfterSeconds=0)
+
+def store_ingestion_file(filename, data):
+    return ingestion_files.put(data, filename=filename)
+
+def load_ingestion_file(file_id):
+    return ingestion_files.get(file_id).read()
+
+def delete_ingestion_file(file_id):
+    ingestion_files.delete(file_id)
+
+def create_ingestion_job(job_id, user_folder, topic, files, owner, lease):
+    """
+    Creates a job for `files`, a list of {"name": ..., "file_id": ...}, leased to `owner`.
+    """
+    now = datetime.datetime.utcnow()
+    db.ingestion_jobs.insert_one({
+        "job_id": job_id,
+        "user_folder": user_folder,
+        "topic": topic,
+        "status": "queued",
+        "files": [{"name": file["name"], "file_id": file["file_id"], "status": "queued", "error": None,
+                   "entry": None} for file in files],
+        "owner": owner,
+        "lease_until": now + lease,
+        "created_at": now,
+        "updated_at": now
+    })
+
+def get_ingestion_job(job_id):
+    """
+    Returns the public view of a job: its status and the progress of every file.
+    """
+    return db.ingestion_jobs.find_one({"job_id": job_id},
+                                      {"_id": 0, "owner": 0, "lease_until": 0, "files.file_id": 0})
+
+def update_ingestion_file(job_id, index, owner, lease, **fields):
+    """
+    Updates the progress of one file of a job and renews the owner's lease on the job.
+    """
+    now = datetime.datetime.utcnow()
+    update = {f"files.{index}.{key}": value for key, value in fields.items()}
+    update.update({"status": "running", "updated_at": now, "owner": owner, "lease_until": now + lease})
+    db.ingestion_jobs.update_one({"job_id": job_id}, {"$set": update})
+
+def finish_ingestion_job_if_complete(job_id, retention):
+    """
+    Marks a job as done once none of its files is still pending. Returns True if it did.
+    """
+    now = datetime.datetime.utcnow()
+    result = db.ingestion_jobs.update_one(
+        {"job_id": job_id, "status": {"$ne": "done"},
+         "files": {"$not": {"$elemMatch": {"status": {"$nin": INGESTION_TERMINAL_STATUSES}}}}},
+        {"$set": {"status": "done", "updated_at": now, "expires_at": now + retention}}
+    )
+    return result.modified_count > 0
+
+def claim_unfinished_ingestion_job(owner, lease):
+    """
+    Takes over one unfinished job whose owner stopped renewing its lease, or returns None.
+    """
+    now = datetime.datetime.utcnow()
+    return db.ingestion_jobs.find_one_and_update(
+        {"status": {"$in": ["queued", "running"]}, "lease_until": {"$lt": now}},
+        {"$set": {"owner": owner, "lease_until": now + lease}},
+        return_document=ReturnDocument.AFTER
+    )
+
+def renew_ingestion_leases(owner, lease):
+    """
+    Extends the lease on every unfinished job held by `owner`.
+    """
+    db.ingestion_jobs.update_many(
+        {"owner": owner, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"lease_until": datetime.datetime.utcnow() + lease}}
+    )
+
+def release_ingestion_leases(owner):
+    """
+    Gives up `owner`'s unfinished jobs, so the next process to look for work takes them over right away.
+    """
+    db.ingestion_jobs.update_many(
+        {"owner": owner, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"lease_until": datetime.datetime.min}}
+    )
+
+# =================== SUMMARY CACHE OPERATIONS ===================
+def ensure_summary_cache_indexes():
+    db.summary_cache.create_index("key", unique=True)
+    db.summary_cache.create_index("expires_at", expireAfterSeconds=0)
+
+def get_cached_summary(key):
+    summary_data = db.summary_cache.find_one({"key": key}, {"_id": 0})
+    if not summary_data or summary_data["expires_at"] < datetime.datetime.utcnow():
+        return None
+    return summary_data["summary"]
+
+def store_cached_summary(key, summary, ttl):
+    db.summary_cache.update_one(
+        {"key": key},
+        {"$set": {"key": key, "summary": summary, "expires_at": datetime.datetime.utcnow() + ttl}},
+        upsert=True
+    )
+
+# =================== ENTRY OPERATIONS ===================
+# Paper entries stored one document per row, plus one entry_topics document per topic that tracks
+# its revision, whether the Drive spreadsheet still has to be rebuilt and whether the spreadsheet the
+# topic started from has been imported
+ENTRY_KEY_FIELDS = {"_id": 0, "user_folder": 0, "topic": 0}
+
+def ensure_entry_indexes():
+    db.entries.create_index([("user_folder", 1), ("topic", 1), ("SL_NO", 1)])
+    db.entries.create_index([("user_folder", 1), ("topic", 1), ("DOI", 1)])
+    db.entry_topics.create_index([("user_folder", 1), ("topic", 1)], unique=True)
+    db.entry_topics.create_index("dirty")
+
+def get_entry_topic(user_folder, topic):
+    return db.entry_topics.find_one({"user_folder": user_folder, "topic": topic}, {"_id": 0})
+
+def claim_entry_topic_import(user_folder, topic, lease):
+    """
+    Claims the import of a topic's existing spreadsheet for `lease`. Returns True if the caller has to
+    import it now: the topic is new, or an earlier import failed or didn't finish within its lease.
+    """
+    now = datetime.datetime.utcnow()
+    try:
+        db.entry_topics.update_one(
+            {"user_folder": user_folder, "topic": topic, "imported": False, "import_lease": {"$lt": now}},
+            {"$set": {"import_lease": now + lease},
+             "$setOnInsert": {"revision": 0, "dirty": False, "updated_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The topic is imported already, or another caller is importing it
+        return False
+    return True
+
+def finish_entry_topic_import(user_folder, topic):
+    db.entry_topics.update_one({"user_folder": user_folder, "topic": topic},
+                               {"$set": {"imported": True}, "$unset": {"import_lease": ""}})
+
+def release_entry_topic_import(user_folder, topic):
+    # Lets the next caller retry a failed import right away
+    db.entry_topics.update_one({"user_folder": user_folder, "topic": topic, "imported": False},
+                               {"$set": {"import_lease": datetime.datetime.min}})
+
+def lock_entry_topic(user_folder, topic, owner, lease):
+    """
+    Takes the write lock of a topic for `owner` until `lease` (a timedelta) from now. Returns False if
+    another owner holds it; a lock whose lease ran out is free again.
+    """
+    now = datetime.datetime.utcnow()
+    result = db.entry_topics.update_one(
+        {"user_folder": user_folder, "topic": topic,
+         "$or": [{"write_lock": {"$exists": False}}, {"write_lock_until": {"$lt": now}}]},
+        {"$set": {"write_lock": owner, "write_lock_until": now + lease}}
+    )
+    return result.matched_count > 0
+
+def unlock_entry_topic(user_folder, topic, owner):
+    db.entry_topics.update_one({"user_folder": user_folder, "topic": topic, "write_lock": owner},
+                               {"$unset": {"write_lock": "", "write_lock_until": ""}})
+
+def mark_entry_topic_synced(user_folder, topic, revision):
+    # Only clear the flag if nothing changed while the spreadsheet was being rebuilt
+    db.entry_topics.update_one({"user_folder": user_folder, "topic": topic, "revision": revision},
+                               {"$set": {"dirty": False}})
+
+def get_dirty_entry_topics():
+    return [(data["user_folder"], data["topic"])
+            for data in db.entry_topics.find({"dirty": True}, {"_id": 0, "user_folder": 1, "topic": 1})]
+
+def get_entry_topic_names(user_folder):
+    return [data["topic"] for data in db.entry_topics.find({"user_folder": user_folder}, {"_id": 0, "topic": 1})]
+
+def get_entries(user_folder, topic):
+    return list(db.entries.find({"user_folder": user_folder, "topic": topic}, ENTRY_KEY_FIELDS).sort("SL_NO", 1))
+
+def get_entry(user_folder, topic, sl_no):
+    return db.entries.find_one({"user_folder": user_folder, "topic": topic, "SL_NO": sl_no}, ENTRY_KEY_FIELDS)
+
+def get_entries_with_ids(user_folder, topic):
+    return list(db.entries.find({"user_folder": user_folder, "topic": topic},
+                                {"user_folder": 0, "topic": 0}).sort("SL_NO", 1))
+
+def claim_entry_topic_revision(user_folder, topic, revision):
+    """
+    Records a change to a topic, bumping its revision and flagging it for the next Drive sync, but only if
+    its revision is still `revision`. Returns False if someone else changed the topic since it was read.
+    """
+    result = db.entry_topics.update_one(
+        {"user_folder": user_folder, "topic": topic, "revision": revision},
+        {"$inc": {"revision": 1}, "$set": {"dirty": True, "updated_at": datetime.datetime.utcnow()}}
+    )
+    return result.modified_count > 0
+
+def apply_entry_changes(user_folder, topic, inserts, updates, deletes):
+    """
+    Writes the entries a batch changed in one ordered bulk write: new entries first, then the changed
+    fields of existing ones (a doc _id -> fields dict), deletions last, so a failure never loses entries.
+    """
+    requests = [InsertOne(dict(entry, user_folder=user_folder, topic=topic)) for entry in inserts]
+    requests += [UpdateOne({"_id": entry_id}, {"$set": fields}) for entry_id, fields in updates.items()]
+    requests += [DeleteOne({"_id": entry_id}) for entry_id in deletes]
+    if requests:
+        db.entries.bulk_write(requests, ordered=True)
+
+def count_entries(user_folder, topic):
+    return db.entries.count_documents({"user_folder": user_folder, "topic": topic})
+
+def insert_entries(user_folder, topic, entries):
+    if entries:
+        db.entries.insert_many([dict(entry, user_folder=user_folder, topic=topic) for entry in entries])
+
+def replace_entries(user_folder, topic, entries):
+    # The new entries are inserted before the old ones are deleted, so a failure never empties the topic
+    inserted = []
+    if entries:
+        inserted = db.entries.insert_many([dict(entry, user_folder=user_folder, topic=topic)
+                                           for entry in entries]).inserted_ids
+    db.entries.delete_many({"user_folder": user_folder, "topic": topic, "_id": {"$nin": inserted}})
+
+def update_entry_fields(user_folder, topic, sl_no, fields):
+    """
+    Sets `fields` on the entry with `sl_no`. Returns the entry as it was before, or None if there is none.
+    """
+    return db.entries.find_one_and_update({"user_folder": user_folder, "topic": topic, "SL_NO": sl_no},
+                                          {"$set": fields}, projection=ENTRY_KEY_FIELDS)
+
+def delete_entry_and_renumber(user_folder, topic, sl_no):
+    """
+    Deletes the entry with `sl_no` and shifts the SL_NO of every later entry down by one.
+    Returns the deleted entry, or None if there is none.
+    """
+    deleted = db.entries.find_one_and_delete({"user_folder": user_folder, "topic": topic, "SL_NO": sl_no},
+                                             projection=ENTRY_KEY_FIELDS)
+    if deleted is None:
+        return None
+    db.entries.update_many({"user_folder": user_folder, "topic": topic, "SL_NO": {"$gt": sl_no}},
+                           {"$inc": {"SL_NO": -1}})
+    return deleted
+
+# =================== SEARCH INDEX OPERATIONS ===================
+# search_docs: one document per indexed entry; search_postings: one document per (term, entry) pair,
+# carrying what BM25 needs (term frequency and entry length) so queries don't join back to the entries.
+# Postings reference entries by doc_id, so renumbering a topic only touches search_docs.
+def ensure_search_indexes():
+    db.search_postings.create_index([("user_folder", 1), ("term", 1)])
+    db.search_postings.create_index("doc_id")
+    db.search_docs.create_index([("user_folder", 1), ("topic", 1)])
+
+def get_search_docs(user_folder, topic):
+    return list(db.search_docs.find({"user_folder": user_folder, "topic": topic}, {"SL_NO": 1, "length": 1}))
+
+def get_search_docs_by_id(doc_ids):
+    return list(db.search_docs.find({"_id": {"$in": list(doc_ids)}}, {"topic": 1, "SL_NO": 1, "NAME": 1}))
+
+def insert_search_docs(docs, postings):
+    if docs:
+        db.search_docs.insert_many(docs)
+    if postings:
+        db.search_postings.insert_many(postings)
+
+def delete_search_docs(doc_ids):
+    if doc_ids:
+        db.search_postings.delete_many({"doc_id": {"$in": list(doc_ids)}})
+        db.search_docs.delete_many({"_id": {"$in": list(doc_ids)}})
+
+def renumber_search_docs(sl_nos):
+    """
+    Sets the SL_NO of indexed entries, given as a doc_id -> SL_NO dict.
+    """
+    if sl_nos:
+        db.search_docs.bulk_write([UpdateOne({"_id": doc_id}, {"$set": {"SL_NO": sl_no}})
+                                   for doc_id, sl_no in sl_nos.items()], ordered=False)
+
+def update_search_stats(user_folder, doc_count, total_length):
+    # Running totals for BM25's document count and average length
+    db.search_stats.update_one({"user_folder": user_folder},
+                               {"$inc": {"doc_count": doc_count, "total_length": total_length}}, upsert=True)
+
+def get_search_stats(user_folder):
+    return db.search_stats.find_one({"user_folder": user_folder}, {"_id": 0}) or {"doc_count": 0, "total_length": 0}
+
+def get_search_postings(user_folder, terms):
+    return list(db.search_postings.find({"user_folder": user_folder, "term": {"$in": list(terms)}},
+                                        {"_id": 0, "term": 1, "doc_id": 1, "topic": 1, "tf": 1, "length": 1}))
+
+# =================== FINGERPRINT OPERATIONS ===================
+# One MinHash signature per ingested paper, keyed by the ENTRY_ID of its entry, with its LSH band keys in a
+# multikey index so near-duplicate candidates are found without scanning the topic
+def ensure_fingerprint_indexes():
+    db.fingerprints.create_index([("user_folder", 1), ("topic", 1), ("bands", 1)])
+    db.fingerprints.create_index([("user_folder", 1), ("topic", 1), ("entry_id", 1)])
+
+def find_fingerprint_candidates(user_folder, topic, bands):
+    return list(db.fingerprints.find({"user_folder": user_folder, "topic": topic, "bands": {"$in": bands}},
+                                     {"bands": 0}))
+
+def store_fingerprint(user_folder, topic, entry_id, signature, bands):
+    db.fingerprints.insert_one({"user_folder": user_folder, "topic": topic, "entry_id": entry_id,
+                                "signature": signature, "bands": bands})
+
+def delete_fingerprints(user_folder, topic, entry_ids):
+    db.fingerprints.delete_many({"user_folder": user_folder, "topic": topic, "entry_id": {"$in": entry_ids}})
+
+# =================== DRIVE CATALOG OPERATIONS ===================
+# drive_catalog: one document per topic file in a user's folder, keyed by Drive file id;
+# drive_sync_state: the Drive changes page token each user's catalog is current up to, and a count of
+# our own writes to the folder, so a listing after a write knows it has to sync first
+def ensure_drive_catalog_indexes():
+    db.drive_catalog.create_index("user_folder")
+    db.drive_sync_state.create_index("user_folder", unique=True)
+
+def get_drive_sync_state(user_folder):
+    return db.drive_sync_state.find_one({"user_folder": user_folder}, {"_id": 0})
+
+def store_drive_sync_state(user_folder, page_token, synced_writes):
+    db.drive_sync_state.update_one({"user_folder": user_folder},
+                                   {"$set": {"page_token": page_token, "synced_writes": synced_writes,
+                                             "synced_at": datetime.datetime.utcnow()}},
+                                   upsert=True)
+
+def mark_drive_catalog_stale(user_folder):
+    db.drive_sync_state.update_one({"user_folder": user_folder}, {"$inc": {"local_writes": 1}}, upsert=True)
+
+def get_catalog_files(user_folder):
+    return list(db.drive_catalog.find({"user_folder": user_folder}, {"user_folder": 0}))
+
+def get_catalog_files_by_id(user_folder, file_ids):
+    return list(db.drive_catalog.find({"_id": {"$in": list(file_ids)}, "user_folder": user_folder}, {"user_folder": 0}))
+
+def upsert_catalog_files(user_folder, files):
+    """
+    Stores or updates catalog documents, given as dicts with the Drive file id in "_id".
+    """
+    if files:
+        db.drive_catalog.bulk_write([UpdateOne({"_id": file["_id"]}, {"$set": dict(file, user_folder=user_folder)},
+                                               upsert=True) for file in files], ordered=False)
+
+def delete_catalog_files(file_ids):
+    if file_ids:
+        db.drive_catalog.delete_many({"_id": {"$in": list(file_ids)}})
+
+def replace_catalog_files(user_folder, files):
+    db.drive_catalog.delete_many({"user_folder": user_folder})
+    upsert_catalog_files(user_folder, files)
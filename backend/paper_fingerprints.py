@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+from mongo_db_ops import ensure_fingerprint_indexes, find_fingerprint_candidates, store_fingerprint, \
+    delete_fingerprints
+
+# MinHash signature length, split into FINGERPRINT_BANDS LSH bands. With 16 bands of 8 rows, pairs
+# above ~0.7 Jaccard similarity almost always share a band and pairs below ~0.4 almost never do.
+FINGERPRINT_PERMUTATIONS = int(os.environ.get("FINGERPRINT_PERMUTATIONS", "128"))
+FINGERPRINT_BANDS = int(os.environ.get("FINGERPRINT_BANDS", "16"))
+# Estimated Jaccard similarity from which a paper counts as a duplicate of one already in the topic
+DUPLICATE_SIMILARITY = float(os.environ.get("DUPLICATE_SIMILARITY", "0.8"))
+SHINGLE_WORDS = 5
+
+_PRIME = np.uint64(4294967311)  # Smallest prime above 2**32
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Fixed seed: stored signatures are only comparable if every process uses the same permutations
+_random = np.random.RandomState(20240601)
+_PERM_A = _random.randint(1, 2 ** 31, size=FINGERPRINT_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _random.randint(0, 2 ** 31, size=FINGERPRINT_PERMUTATIONS, dtype=np.uint64)
+
+_WORD = re.compile(r'\w+')
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+
+class DuplicatePaper(Exception):
+    """
+    Raised by the ingestion pipeline for a paper that is already in the topic.
+    """
+
+    def __init__(self, reason, entry, similarity=1.0):
+        super().__init__(f"Duplicate of entry {entry.get('SL_NO')} ({reason})")
+        self.reason = reason  # "doi" or "text"
+        self.entry = entry
+        self.similarity = similarity
+
+    def to_dict(self):
+        return {"reason": self.reason, "similarity": round(self.similarity, 3),
+                "duplicate_of": {"SL_NO": self.entry.get("SL_NO"), "NAME": self.entry.get("NAME"),
+                                 "DOI": self.entry.get("DOI")}}
+
+
+def shingles(text, title=""):
+    words = _WORD.findall(text.lower())
+    result = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))}
+    result.discard("")
+    # The title counts as a few extra shingles, so papers with little extractable text still compare on it
+    result.update(f"title:{word}" for word in _WORD.findall(title.lower()))
+    return result
+
+
+def minhash_signature(text, title=""):
+    """
+    MinHash signature of the word shingles of `text` and `title`, or None if there is nothing to hash.
+    """
+    shingle_set = shingles(text, title)
+    if not shingle_set:
+        return None
+    hashes = np.fromiter((int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+                          for shingle in shingle_set), dtype=np.uint64, count=len(shingle_set))
+    # (a * x + b) mod p for every permutation and shingle; a, b < 2**31 and x < 2**32 can't overflow
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME & _MAX_HASH
+    return permuted.min(axis=1).tolist()
+
+
+def band_keys(signature):
+    rows = len(signature) // FINGERPRINT_BANDS
+    keys = []
+    for band in range(FINGERPRINT_BANDS):
+        band_rows = repr(signature[band * rows:(band + 1) * rows]).encode()
+        keys.append(f"{band}:{hashlib.blake2b(band_rows, digest_size=8).hexdigest()}")
+    return keys
+
+
+def signature_similarity(a, b):
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if not _indexes_ready:
+            ensure_fingerprint_indexes()
+            _indexes_ready = True
+
+
+def find_near_duplicate(user_folder, topic, signature, records):
+    """
+    Returns (entry, similarity) of the most similar paper of the topic at or above DUPLICATE_SIMILARITY,
+    or None. Only papers sharing an LSH band are compared, and only fingerprints of entries still in
+    `records` (the topic's current entries), matched by ENTRY_ID, count.
+    """
+    if signature is None:
+        return None
+    _ensure_indexes()
+    entries = {record["ENTRY_ID"]: record for record in records if record.get("ENTRY_ID")}
+    best = None
+    for candidate in find_fingerprint_candidates(user_folder, topic, band_keys(signature)):
+        # Fingerprints stored before entries had ids carry none and never match
+        entry = entries.get(candidate.get("entry_id"))
+        if entry is None:
+            continue
+        similarity = signature_similarity(signature, candidate["signature"])
+        if similarity >= DUPLICATE_SIMILARITY and (best is None or similarity > best[1]):
+            best = (entry, similarity)
+    return best
+
+
+def remember_fingerprint(user_folder, topic, entry, signature):
+    if signature is None:
+        return
+    _ensure_indexes()
+    store_fingerprint(user_folder, topic, entry["ENTRY_ID"], signature, band_keys(signature))
+
+
+def track_entry_changes(user_folder, topic, changes):
+    """
+    Topic storage entry listener: a deleted entry's fingerprint goes away with it.
+    """
+    entry_ids = [before["ENTRY_ID"] for before, after in changes if after is None and before.get("ENTRY_ID")]
+    if entry_ids:
+        _ensure_indexes()
+        delete_fingerprints(user_folder, topic, entry_ids)
@@ -0,0 +1,137 @@
+import asyncio
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from metrics import timed
+
+# Number of processes used to extract PDFs in parallel
+PDF_WORKERS = max(1, int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1)))
+
+DOI_PATTERN = re.compile(r'\b10\.\d{4,9}/[-._;()/:A-Z0-9]+\b', re.IGNORECASE)
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
+@dataclass
+class PdfExtraction:
+    doi: str  # First DOI found in the document, or "Unknown"
+    text: str  # Text of the pages kept for summarization
+    page_count: int
+    pages_used: int  # Number of pages whose text is in `text`
+    doi_page: int  # 1-based page the DOI was found on, 0 if none was found
+    title: str = ""  # From the PDF metadata, else the first line of the first page that looks like one
+
+
+def iter_page_texts(pdf_document):
+    # Pages are read one at a time so callers can stop as soon as they have what they need
+    for page in pdf_document:
+        yield page.get_text()
+
+
+def extract_doi(text):
+    match = DOI_PATTERN.search(text)
+    if match:
+        return match.group(0).strip()
+    return "Unknown"
+
+
+def extract_title(metadata, first_page_text):
+    title = (metadata or {}).get("title", "").strip()
+    # Producers often fill in a file name or placeholder instead of the title
+    if len(title.split()) >= 3 and not title.lower().endswith((".pdf", ".doc", ".docx", ".tex", ".dvi")):
+        return title
+    for line in first_page_text.splitlines():
+        line = line.strip()
+        if len(line.split()) >= 3 and len(line) <= 300 and not DOI_PATTERN.search(line):
+            return line
+    return ""
+
+
+def extract_pdf(pdf_data, max_text_chars=None):
+    """
+    Opens the PDF once and streams its pages.
+    The DOI scan stops at the first match, and page text is only kept until `max_text_chars`
+    is reached (None keeps every page). Reading stops once both are satisfied.
+    `pdf_data` can be raw bytes or a binary stream.
+    """
+    if hasattr(pdf_data, "seek"):
+        pdf_data.seek(0)  # Reset the stream to the beginning
+        pdf_data = pdf_data.read()
+
+    import fitz  # PyMuPDF, imported on first use since it is only needed when parsing
+
+    doi = "Unknown"
+    doi_page = 0
+    title = ""
+    pages = []
+    chars = 0
+    with fitz.open(stream=pdf_data, filetype="pdf") as pdf_reader:
+        page_count = pdf_reader.page_count
+        for page_num, page_text in enumerate(iter_page_texts(pdf_reader), start=1):
+            if page_num == 1:
+                title = extract_title(pdf_reader.metadata, page_text)
+            if not doi_page:
+                doi = extract_doi(page_text)
+                if doi != "Unknown":
+                    doi_page = page_num
+
+            text_full = max_text_chars is not None and chars >= max_text_chars
+            if not text_full:
+                pages.append(page_text)
+                chars += len(page_text)
+            elif doi_page:
+                break
+
+    text = "".join(pages)
+    if max_text_chars is not None:
+        text = text[:max_text_chars]
+    return PdfExtraction(doi=doi, text=text, page_count=page_count, pages_used=len(pages), doi_page=doi_page,
+                         title=title)
+
+
+def get_extraction_pool():
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            # Spawned workers only import this module, not the summarizer and its model
+            _extraction_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+        return _extraction_pool
+
+
+def shutdown_extraction_pool():
+    global _extraction_pool
+    with _extraction_pool_lock:
+        pool, _extraction_pool = _extraction_pool, None
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@timed("extract_pdf")
+async def extract_pdf_async(pdf_bytes, max_text_chars=None):
+    """
+    Extracts one PDF in the process pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_extraction_pool(), extract_pdf, pdf_bytes, max_text_chars)
+
+
+async def extract_pdfs(named_pdfs, max_text_chars=None):
+    """
+    Extracts a batch of PDFs in the process pool.
+    `named_pdfs` is a list of (name, pdf bytes). Yields (name, PdfExtraction) as each file finishes,
+    in completion order; a file that fails yields (name, exception) instead.
+    """
+    async def run(name, pdf_bytes):
+        try:
+            return name, await extract_pdf_async(pdf_bytes, max_text_chars)
+        except Exception as e:
+            return name, e
+
+    for next_done in asyncio.as_completed([run(name, pdf_bytes) for name, pdf_bytes in named_pdfs]):
+        yield await next_done
@@ -0,0 +1,148 @@
+import hashlib
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from mongo_db_ops import ensure_search_indexes, get_search_docs, get_search_docs_by_id, insert_search_docs, \
+    delete_search_docs, renumber_search_docs, update_search_stats, get_search_stats, get_search_postings
+
+SEARCH_FIELDS = ["NAME", "ABSTRACT", "SUMMARY", "AUTHOR", "REMARKS"]
+# BM25 parameters
+SEARCH_K1 = float(os.environ.get("SEARCH_K1", "1.2"))
+SEARCH_B = float(os.environ.get("SEARCH_B", "0.75"))
+
+_TOKEN = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or that the their this to was "
+    "were which with we our not can these those than also been".split()
+)
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(str(text).lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+def _entry_content(record):
+    return "\0".join(str(record.get(field, "")) for field in SEARCH_FIELDS)
+
+
+def build_search_docs(user_folder, topic, records):
+    """
+    Returns doc_id -> (SL_NO, NAME, term frequencies, length) for the entries of a topic. The doc_id is
+    derived from the indexed text, so an entry keeps its doc_id when only its SL_NO changes.
+    """
+    docs = {}
+    occurrences = Counter()
+    for record in records:
+        content = _entry_content(record)
+        occurrences[content] += 1
+        key = f"{user_folder}\0{topic}\0{content}\0{occurrences[content]}"
+        terms = Counter(tokenize(content))
+        docs[hashlib.sha1(key.encode('utf-8')).hexdigest()] = (record["SL_NO"], str(record.get("NAME", "")), terms,
+                                                              sum(terms.values()))
+    return docs
+
+
+def index_topic(user_folder, topic, records):
+    """
+    Brings the index of a topic in line with its records, only touching entries that changed.
+    """
+    docs = build_search_docs(user_folder, topic, records)
+    indexed = {doc["_id"]: doc for doc in get_search_docs(user_folder, topic)}
+
+    removed = [doc_id for doc_id in indexed if doc_id not in docs]
+    added = [doc_id for doc_id in docs if doc_id not in indexed]
+    renumbered = {doc_id: docs[doc_id][0] for doc_id in docs
+                  if doc_id in indexed and indexed[doc_id]["SL_NO"] != docs[doc_id][0]}
+
+    delete_search_docs(removed)
+    new_docs, postings = [], []
+    for doc_id in added:
+        sl_no, name, terms, length = docs[doc_id]
+        new_docs.append({"_id": doc_id, "user_folder": user_folder, "topic": topic, "SL_NO": sl_no, "NAME": name,
+                         "length": length})
+        postings.extend({"user_folder": user_folder, "term": term, "doc_id": doc_id, "topic": topic, "tf": tf,
+                         "length": length} for term, tf in terms.items())
+    insert_search_docs(new_docs, postings)
+    renumber_search_docs(renumbered)
+
+    length_delta = sum(docs[doc_id][3] for doc_id in added) - sum(indexed[doc_id]["length"] for doc_id in removed)
+    if added or removed:
+        update_search_stats(user_folder, len(added) - len(removed), length_delta)
+    return {"added": len(added), "removed": len(removed), "renumbered": len(renumbered)}
+
+
+def search(user_folder, query, topic=None, limit=20):
+    """
+    BM25-ranked entries of all of a user's topics (or one topic) matching any term of `query`.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+    stats = get_search_stats(user_folder)
+    doc_count = max(stats["doc_count"], 1)
+    average_length = stats["total_length"] / doc_count or 1.0
+
+    postings = get_search_postings(user_folder, terms)
+    document_frequency = Counter(posting["term"] for posting in postings)
+    scores = {}
+    for posting in postings:
+        if topic and posting["topic"] != topic:
+            continue
+        df = document_frequency[posting["term"]]
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        tf = posting["tf"]
+        norm = SEARCH_K1 * (1 - SEARCH_B + SEARCH_B * posting["length"] / average_length)
+        scores[posting["doc_id"]] = scores.get(posting["doc_id"], 0.0) + idf * tf * (SEARCH_K1 + 1) / (tf + norm)
+
+    top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+    docs = {doc["_id"]: doc for doc in get_search_docs_by_id(doc_id for doc_id, _ in top)}
+    return [{"topic": docs[doc_id]["topic"], "SL_NO": docs[doc_id]["SL_NO"], "NAME": docs[doc_id].get("NAME", ""),
+             "score": round(score, 4)}
+            for doc_id, score in top if doc_id in docs]
+
+
+class SearchIndexer:
+    """
+    Re-indexes changed topics in a background thread. Register `schedule` as a topic storage listener;
+    a topic changed several times before its turn comes is indexed once.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def schedule(self, user_folder, topic):
+        with self._lock:
+            if (user_folder, topic) in self._pending:
+                return
+            self._pending.add((user_folder, topic))
+        self._executor.submit(self._index, user_folder, topic)
+
+    def schedule_user(self, user_folder):
+        """
+        Indexes every topic of a user, e.g. topics created before the index existed.
+        """
+        for topic in self.storage.list_topics(user_folder):
+            self.schedule(user_folder, topic)
+
+    def _index(self, user_folder, topic):
+        with self._lock:
+            self._pending.discard((user_folder, topic))
+        try:
+            if not self._indexes_ready:
+                ensure_search_indexes()
+                self._indexes_ready = True
+            index_topic(user_folder, topic, self.storage.load(user_folder, topic))
+        except Exception as e:
+            print(f"Error indexing {topic} for search: {e}")
+
+    def stop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
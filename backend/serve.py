@@ -0,0 +1,52 @@
+"""
+Launcher: starts one model server process (model_server.py) and then uvicorn with HTTP workers that share
+it, so a worker doesn't keep its own copy of the summarizer.
+
+    python serve.py --port 8000
+
+Only one HTTP worker is allowed for now: SL_NO numbering, the duplicate checks under the topic locks and the
+Excel export timers are all serialized per process, so several workers would number and export topics
+over each other, whatever the topic storage.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import uvicorn
+
+from model_server import DEFAULT_SOCKET, MODEL_SERVER_TIMEOUT, SUMMARIZER_SERVER_SOCKET, ModelServerClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="Number of HTTP worker processes; only 1 is supported")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=SUMMARIZER_SERVER_SOCKET or DEFAULT_SOCKET,
+                        help="Unix socket the model server listens on")
+    args = parser.parse_args()
+
+    # Topic writes are only serialized within a process, see above
+    if args.workers != 1:
+        parser.error(f"--workers {args.workers} is not supported, topic writes are only safe with one worker")
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    model_server = subprocess.Popen([sys.executable, os.path.join(backend_dir, "model_server.py"),
+                                     "--socket", args.socket], cwd=backend_dir)
+    try:
+        # Workers that start before the model is loaded would report not ready anyway
+        print(f"Waiting for the model server on {args.socket}")
+        ModelServerClient(args.socket).wait_ready(MODEL_SERVER_TIMEOUT)
+        os.environ["SUMMARIZER_SERVER_SOCKET"] = args.socket
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=backend_dir)
+    finally:
+        model_server.terminate()
+        try:
+            model_server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            model_server.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import asyncio
+import os
+from itertools import islice
+
+from executors import run_cpu
+from inference_scheduler import InferenceScheduler
+from metrics import timed
+from model_registry import model_registry
+from model_server import SUMMARIZER_SERVER_SOCKET, ModelServerClient
+from summary_cache import cached_summary, summary_cache_key
+
+# Hub name or local path of the checkpoint, e.g. a distilled one such as sshleifer/distilbart-cnn-12-6
+SUMMARIZER_MODEL_NAME = os.environ.get("SUMMARIZER_MODEL_NAME", "facebook/bart-large-cnn")
+# Inference backend: "fp32", or "int8" for dynamic int8 quantization of the linear layers (CPU only)
+SUMMARIZER_BACKEND = os.environ.get("SUMMARIZER_BACKEND", "fp32")
+# Decoding preset, one of DECODING_PRESETS
+SUMMARY_DECODING = os.environ.get("SUMMARY_DECODING", "beam4")
+# Torch thread pools; 0 keeps torch's default
+TORCH_INTRA_OP_THREADS = int(os.environ.get("TORCH_INTRA_OP_THREADS", "0"))
+TORCH_INTER_OP_THREADS = int(os.environ.get("TORCH_INTER_OP_THREADS", "0"))
+SUMMARY_MAX_BATCH_SIZE = int(os.environ.get("SUMMARY_MAX_BATCH_SIZE", "8"))
+SUMMARY_MAX_WAIT_MS = float(os.environ.get("SUMMARY_MAX_WAIT_MS", "50"))
+
+# Long-document mode: the paper is split into token-bounded sections, the sections are summarized
+# together (map) and their summaries are summarized once more (reduce).
+# SUMMARY_MAX_SECTIONS=1 gives the old behaviour of truncating the paper to one model input.
+SUMMARY_MAX_SECTIONS = max(1, int(os.environ.get("SUMMARY_MAX_SECTIONS", "4")))
+# BART accepts 1024 positions, two of which are taken by the <s> and </s> tokens
+SUMMARY_SECTION_TOKENS = min(int(os.environ.get("SUMMARY_SECTION_TOKENS", "1022")), 1022)
+# Size of the text blocks handed to the tokenizer while sections are being filled
+TOKENIZE_BLOCK_CHARS = 4000
+# Upper bound on how much text the summarizer can use. English averages about 4 characters per
+# token; 8 leaves room for symbol-heavy text, and any excess is never tokenized anyway.
+SUMMARY_INPUT_CHAR_BUDGET = SUMMARY_MAX_SECTIONS * SUMMARY_SECTION_TOKENS * 8
+
+DECODING_PRESETS = {
+    "beam4": {"num_beams": 4, "max_length": 150, "early_stopping": True},
+    "beam2": {"num_beams": 2, "max_length": 150, "early_stopping": True},
+    "greedy": {"num_beams": 1, "max_length": 150},
+}
+SUMMARIZER_BACKENDS = ("fp32", "int8")
+if SUMMARY_DECODING not in DECODING_PRESETS:
+    raise ValueError(f"Unknown SUMMARY_DECODING {SUMMARY_DECODING}, expected one of {list(DECODING_PRESETS)}")
+
+# Everything that changes the summary of a given text; part of the summary cache key
+SUMMARIZER_CONFIG_ID = (f"{SUMMARIZER_MODEL_NAME}|{SUMMARIZER_BACKEND}|{SUMMARY_DECODING}|"
+                        f"{SUMMARY_MAX_SECTIONS}|{SUMMARY_SECTION_TOKENS}")
+
+_torch_threads_configured = False
+
+
+def configure_torch_threads():
+    global _torch_threads_configured
+    if _torch_threads_configured:
+        return
+    import torch
+    if TORCH_INTRA_OP_THREADS:
+        torch.set_num_threads(TORCH_INTRA_OP_THREADS)
+    if TORCH_INTER_OP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTER_OP_THREADS)
+        except RuntimeError as e:
+            # Only allowed before torch runs any inter-op parallel work
+            print(f"Could not set inter-op threads: {e}")
+    _torch_threads_configured = True
+
+
+# The summarizer is loaded on first use; transformers and torch are only imported then
+def build_summarizer_tokenizer(model_name=SUMMARIZER_MODEL_NAME):
+    from transformers import BartTokenizer
+    return BartTokenizer.from_pretrained(model_name)
+
+
+def build_summarizer_model(model_name=SUMMARIZER_MODEL_NAME, backend=SUMMARIZER_BACKEND):
+    if backend not in SUMMARIZER_BACKENDS:
+        raise ValueError(f"Unknown summarizer backend {backend}, expected one of {SUMMARIZER_BACKENDS}")
+    import torch
+    from transformers import BartForConditionalGeneration
+
+    configure_torch_threads()
+    model = BartForConditionalGeneration.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        # Weights of every nn.Linear are stored as int8; activations are quantized on the fly
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_summarizer_tokenizer():
+    return build_summarizer_tokenizer()
+
+
+def load_summarizer_model():
+    if SUMMARIZER_SERVER_SOCKET:
+        # The model lives in the model server; this process only needs a connection to it
+        client = ModelServerClient(SUMMARIZER_SERVER_SOCKET)
+        status = client.wait_ready()
+        if status["config_id"] != SUMMARIZER_CONFIG_ID:
+            # Summaries are cached under our config id, so both sides must summarize the same way
+            raise ValueError(f"Model server runs {status['config_id']}, expected {SUMMARIZER_CONFIG_ID}")
+        return client
+    return build_summarizer_model()
+
+
+model_registry.register("summarizer_tokenizer", load_summarizer_tokenizer)
+model_registry.register("summarizer_model", load_summarizer_model)
+
+
+def iter_text_blocks(text, block_chars=TOKENIZE_BLOCK_CHARS):
+    # Cut on whitespace so no word is split between two blocks
+    start = 0
+    while start < len(text):
+        end = start + block_chars
+        if end < len(text):
+            split = max(text.rfind(' ', start + 1, end), text.rfind('\n', start + 1, end))
+            if split > start:
+                end = split
+        yield text[start:end]
+        start = end
+
+
+def iter_token_sections(text, section_tokens=SUMMARY_SECTION_TOKENS, tokenizer=None):
+    """
+    Yields lists of token ids of at most `section_tokens` each.
+    Text is tokenized block by block only as sections are consumed, so stopping early
+    (e.g. with `islice`) never tokenizes the rest of the document.
+    """
+    summarizer_tokenizer = tokenizer or model_registry.get("summarizer_tokenizer")
+    buffer = []
+    for block in iter_text_blocks(text):
+        buffer.extend(summarizer_tokenizer.encode(block, add_special_tokens=False))
+        while len(buffer) >= section_tokens:
+            yield buffer[:section_tokens]
+            buffer = buffer[section_tokens:]
+    if buffer:
+        yield buffer
+
+
+def generate_summaries(tokenizer, model, token_sections, decoding):
+    import torch
+
+    # Pad to the longest section in the batch so all of them go through a single generate call
+    input_ids = [tokenizer.build_inputs_with_special_tokens(ids) for ids in token_sections]
+    inputs = tokenizer.pad({'input_ids': input_ids}, return_tensors='pt')
+    with torch.inference_mode():
+        summary_ids = model.generate(inputs['input_ids'], attention_mask=inputs['attention_mask'], **decoding)
+    return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+
+def summarize_batch(token_sections):
+    if SUMMARIZER_SERVER_SOCKET:
+        return model_registry.get("summarizer_model").summarize(token_sections)
+    return generate_summaries(model_registry.get("summarizer_tokenizer"), model_registry.get("summarizer_model"),
+                              token_sections, DECODING_PRESETS[SUMMARY_DECODING])
+
+
+summary_scheduler = InferenceScheduler(summarize_batch, max_batch_size=SUMMARY_MAX_BATCH_SIZE,
+                                       max_wait=SUMMARY_MAX_WAIT_MS / 1000, name="summarizer")
+
+
+async def summarize_sections(sections):
+    # All sections are queued together so the scheduler runs them as one batch
+    futures = summary_scheduler.submit_many(sections)
+    return await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+
+@timed("summarize")
+async def get_summary_and_takeaways(text):
+    # Identical papers (re-uploads, other topics, other users) are only summarized once
+    key = await run_cpu(summary_cache_key, text, SUMMARIZER_CONFIG_ID)
+    summary = await cached_summary(key, lambda: summarize_text(text))
+    key_takeaways = summary  # For simplicity, using the summary as key takeaways
+    return summary, key_takeaways
+
+
+async def summarize_text(text):
+    # Tokenization runs in the CPU pool, generate on the scheduler's own thread
+    sections = await run_cpu(lambda: list(islice(iter_token_sections(text), SUMMARY_MAX_SECTIONS)))
+    if not sections:
+        return ""
+
+    # Map: one summary per section
+    section_summaries = await summarize_sections(sections)
+
+    # Reduce: combine the section summaries into the final summary
+    summary = section_summaries[0]
+    if len(section_summaries) > 1:
+        combined = await run_cpu(next, iter_token_sections(" ".join(section_summaries)), None)
+        if combined:
+            summary = (await summarize_sections([combined]))[0]
+    return summary
@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+import hashlib
+import os
+import re
+import threading
+
+from cache_utils import LRUCache
+from executors import run_io
+from mongo_db_ops import ensure_summary_cache_indexes, get_cached_summary, store_cached_summary
+
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", "2048"))
+SUMMARY_CACHE_TTL = datetime.timedelta(days=float(os.environ.get("SUMMARY_CACHE_TTL_DAYS", "90")))
+
+# In-process front of the MongoDB cache: key -> summary
+summary_memory_cache = LRUCache(SUMMARY_CACHE_SIZE, name="summary")
+
+# key -> future of a summary being computed, so identical papers in flight are summarized once
+_in_flight = {}
+
+_indexes_ready = False
+_indexes_lock = threading.Lock()
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def summary_cache_key(text, config_id):
+    """
+    SHA-256 of the whitespace-normalized text and the summarizer configuration that produced the summary.
+    """
+    normalized = _WHITESPACE.sub(' ', text).strip()
+    return hashlib.sha256(f"{config_id}\0{normalized}".encode('utf-8')).hexdigest()
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    with _indexes_lock:
+        if not _indexes_ready:
+            ensure_summary_cache_indexes()
+            _indexes_ready = True
+
+
+def _lookup_persistent_cache(key):
+    try:
+        _ensure_indexes()
+        return get_cached_summary(key)
+    except Exception as e:
+        # The cache is an optimization, summarizing must keep working without it
+        print(f"Error reading summary cache: {e}")
+        return None
+
+
+def _store_persistent_cache(key, summary):
+    try:
+        store_cached_summary(key, summary, SUMMARY_CACHE_TTL)
+    except Exception as e:
+        print(f"Error writing summary cache: {e}")
+
+
+async def cached_summary(key, compute):
+    """
+    Returns the summary cached under `key`, or awaits `compute()` to produce and cache it.
+    """
+    summary = summary_memory_cache.get(key)
+    if summary is not None:
+        return summary
+
+    in_flight = _in_flight.get(key)
+    if in_flight:
+        return await asyncio.shield(in_flight)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        summary = await run_io(_lookup_persistent_cache, key)
+        if summary is None:
+            summary = await compute()
+            await run_io(_store_persistent_cache, key, summary)
+        summary_memory_cache.set(key, summary)
+        future.set_result(summary)
+        return summary
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Nobody else may be waiting; mark the exception as retrieved
+        future.exception()
+        raise
+    finally:
+        del _in_flight[key]
@@ -0,0 +1,60 @@
+import os
+
+from cache_utils import LRUCache
+
+# Upper bound on the (estimated) memory used by cached topic records
+TOPIC_CACHE_MAX_BYTES = int(os.environ.get("TOPIC_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Fields requested whenever a topic file is listed or written, enough to tell whether our copy is current
+TOPIC_REVISION_FIELDS = 'id, name, md5Checksum, headRevisionId, modifiedTime'
+TOPIC_FILE_FIELDS = f'files({TOPIC_REVISION_FIELDS})'
+
+
+def estimate_records_size(entry):
+    # Rough per-value overhead of a Python str/int inside a dict
+    return sum(64 + len(str(value)) for record in entry["records"] for value in record.values())
+
+
+# (user_folder, topic) -> {"file_id": ..., "revision": ..., "records": [...]}
+topic_cache = LRUCache(TOPIC_CACHE_MAX_BYTES, sizeof=estimate_records_size, name="topic")
+
+
+def file_revision(drive_file):
+    # Uploaded .xlsx files have an md5Checksum; fall back for files without one
+    return drive_file.get('md5Checksum') or drive_file.get('headRevisionId') or drive_file.get('modifiedTime')
+
+
+def get_cached_records(user_folder, topic, drive_file):
+    """
+    Returns a copy of the cached records if they were loaded from the same revision of `drive_file`,
+    otherwise None.
+    """
+    entry = topic_cache.get((user_folder, topic))
+    if not entry or entry["file_id"] != drive_file['id'] or entry["revision"] != file_revision(drive_file):
+        return None
+    return [dict(record) for record in entry["records"]]
+
+
+def store_records(user_folder, topic, drive_file, records):
+    topic_cache.set((user_folder, topic), {
+        "file_id": drive_file['id'],
+        "revision": file_revision(drive_file),
+        "records": [dict(record) for record in records],
+    })
+
+
+def invalidate_topic(user_folder, topic):
+    topic_cache.pop((user_folder, topic))
+
+
+def drop_stale_records(user_folder, topic, drive_file=None):
+    """
+    Drops the cached records of a topic unless they were loaded from the current revision of `drive_file`
+    (None if the file is gone). Returns True if they were current, e.g. because the change was our own write.
+    """
+    entry = topic_cache.get((user_folder, topic))
+    if entry and drive_file and entry["file_id"] == drive_file['id'] \
+            and entry["revision"] == file_revision(drive_file):
+        return True
+    invalidate_topic(user_folder, topic)
+    return False
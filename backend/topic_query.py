@@ -0,0 +1,128 @@
+import hashlib
+import json
+import re
+import zlib
+
+from topic_storage import TOPIC_COLUMNS
+
+# Columns /existing_data can sort and filter on
+QUERY_COLUMNS = ["SL_NO", "YEAR", "PUBLICATION", "AUTHOR"]
+# Records serialized per chunk of a streamed response
+RESPONSE_CHUNK_RECORDS = 100
+
+_ETAG = re.compile(r'\*|(?:W/)?"[^"]*"')
+
+
+def parse_fields(fields):
+    """
+    Parses a comma-separated `fields=` projection. SL_NO is always included, since entries are addressed by it.
+    """
+    if not fields:
+        return None
+    columns = [column.strip().upper() for column in fields.split(",") if column.strip()]
+    unknown = [column for column in columns if column not in TOPIC_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, expected some of {TOPIC_COLUMNS}")
+    return ["SL_NO"] + [column for column in columns if column != "SL_NO"]
+
+
+def _sort_key(column):
+    def key(record):
+        value = record.get(column, "")
+        # Numbers (e.g. YEAR) sort numerically and before text; text sorts case-insensitively
+        try:
+            return 0, float(value), ""
+        except (TypeError, ValueError):
+            return 1, 0.0, str(value).lower()
+    return key
+
+
+def query_records(records, year=None, publication=None, author=None, sort=None, offset=0, limit=None,
+                  fields=None):
+    """
+    Filters, sorts, pages and projects topic records. `year` matches exactly, `publication` and `author`
+    match case-insensitive substrings; `sort` is a column name, prefixed with "-" for descending order.
+    Returns (total number of matching records, records of the requested page).
+    """
+    if year is not None:
+        records = [record for record in records if str(record.get("YEAR", "")).strip() == str(year).strip()]
+    if publication:
+        publication = publication.lower()
+        records = [record for record in records if publication in str(record.get("PUBLICATION", "")).lower()]
+    if author:
+        author = author.lower()
+        records = [record for record in records if author in str(record.get("AUTHOR", "")).lower()]
+
+    if sort:
+        column = sort.lstrip("-").upper()
+        if column not in QUERY_COLUMNS:
+            raise ValueError(f"Can't sort by {column}, expected one of {QUERY_COLUMNS}")
+        # Entries without a value go last in either direction
+        blank = [record for record in records if str(record.get(column, "")).strip() == ""]
+        records = sorted((record for record in records if str(record.get(column, "")).strip() != ""),
+                         key=_sort_key(column), reverse=sort.startswith("-")) + blank
+
+    total = len(records)
+    records = records[offset:offset + limit] if limit is not None else records[offset:]
+
+    columns = parse_fields(fields)
+    if columns:
+        records = [{column: record.get(column, "") for column in columns} for record in records]
+    return total, records
+
+
+def records_etag(revision, *query):
+    """
+    Weak ETag of a response built from the topic at `revision` with the given query parameters,
+    or None if the storage can't tell revisions apart.
+    """
+    if revision is None:
+        return None
+    digest = hashlib.sha1(json.dumps([str(revision), *query], default=str).encode('utf-8')).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    True if an If-None-Match header (a comma-separated list of ETags, or "*") matches `etag`. ETags
+    compare weakly, as If-None-Match asks for.
+    """
+    if not if_none_match or not etag:
+        return False
+    tags = _ETAG.findall(if_none_match)
+    return "*" in tags or etag.removeprefix("W/") in {tag.removeprefix("W/") for tag in tags}
+
+
+def accepts_encoding(accept_encoding, coding):
+    """
+    True if an Accept-Encoding header allows `coding`: listed, or covered by "*", with a q-value above 0.
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities.get(coding, qualities.get("*", 0.0)) > 0
+
+
+def iter_records_json(records, gzip=False):
+    """
+    Yields `records` as a JSON array in chunks, optionally gzip-encoded with every chunk flushed,
+    so clients can start parsing large topics before the whole response is built.
+    """
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+    for start in range(0, max(len(records), 1), RESPONSE_CHUNK_RECORDS):
+        chunk = ",".join(json.dumps(record, default=str) for record in records[start:start + RESPONSE_CHUNK_RECORDS])
+        data = (("[" if start == 0 else ",") + chunk if chunk else "[").encode('utf-8')
+        yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+    yield compressor.compress(b"]") + compressor.flush() if compressor else b"]"
@@ -0,0 +1,836 @@
+import contextlib
+import datetime
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+
+from google_drive_helper import get_user_service
+from metrics import drive_bytes, span
+from mongo_db_ops import ensure_entry_indexes, get_entry_topic, claim_entry_topic_import, \
+    finish_entry_topic_import, release_entry_topic_import, lock_entry_topic, unlock_entry_topic, \
+    mark_entry_topic_synced, get_dirty_entry_topics, get_entry_topic_names, get_entry, get_entries, \
+    insert_entries, replace_entries, update_entry_fields, delete_entry_and_renumber, count_entries, \
+    get_entries_with_ids, claim_entry_topic_revision, apply_entry_changes
+from topic_cache import TOPIC_FILE_FIELDS, TOPIC_REVISION_FIELDS, get_cached_records, store_records, \
+    invalidate_topic, file_revision
+
+TOPIC_COLUMNS = ["SL_NO", "NAME", "YEAR", "PUBLICATION", "PAGE_NO", "SUMMARY", "ABSTRACT", "DOI", "AUTHOR", "REMARKS",
+                 "ENTRY_ID"]
+# Set by the storage rather than by edits: SL_NO is the entry's position, ENTRY_ID names it for good
+STORAGE_COLUMNS = ("SL_NO", "ENTRY_ID")
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+JSONL_MIMETYPE = 'application/x-ndjson'
+
+# Primary topic storage: "drive_xlsx", "drive_jsonl", "local_jsonl" or "mongo"
+TOPIC_STORAGE = os.environ.get("TOPIC_STORAGE", "drive_xlsx")
+LOCAL_TOPIC_DIR = os.environ.get("LOCAL_TOPIC_DIR", "data/topics")
+# With the mongo storage, topics that only exist as Drive spreadsheets are imported on first use
+MONGO_IMPORT_FROM_DRIVE = os.environ.get("MONGO_IMPORT_FROM_DRIVE", "true").lower() == "true"
+# Seconds an import may take before another process assumes it failed and imports the topic again
+MONGO_IMPORT_LEASE = datetime.timedelta(seconds=int(os.environ.get("MONGO_IMPORT_LEASE_SECONDS", "300")))
+# With a non-Excel primary storage, the Drive .xlsx is re-exported this many seconds after the
+# last change to a topic; 0 only exports on request
+EXCEL_EXPORT_DEBOUNCE = float(os.environ.get("EXCEL_EXPORT_DEBOUNCE", "30"))
+# Seconds a process may hold a mongo topic's write lock before another one assumes it died and takes it
+MONGO_WRITE_LOCK_LEASE = datetime.timedelta(seconds=int(os.environ.get("MONGO_WRITE_LOCK_LEASE_SECONDS", "30")))
+# Times a mongo change is recomputed when another process changes the topic while it is being applied
+MONGO_WRITE_ATTEMPTS = 5
+
+
+def normalize_records(records):
+    # Same shape the spreadsheet has always had: the topic columns in order, empty cells as ""
+    return [{column: "" if record.get(column) is None else record.get(column) for column in TOPIC_COLUMNS}
+            for record in records]
+
+
+def records_to_excel(records):
+    import pandas as pd  # Imported on first use to keep startup fast
+
+    # Create the Excel file in-memory using a BytesIO buffer
+    excel_buffer = io.BytesIO()
+    # Selecting the columns up front also gives an empty topic its header row
+    df = pd.DataFrame(records, columns=TOPIC_COLUMNS)
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return excel_buffer.getvalue()
+
+
+def excel_to_records(data):
+    import pandas as pd  # Imported on first use to keep startup fast
+
+    df = pd.read_excel(io.BytesIO(data))
+    df = df.fillna("")  # Handle any missing values
+    return df.to_dict(orient='records')
+
+
+def records_to_jsonl(records):
+    return "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records).encode('utf-8')
+
+
+def jsonl_to_records(data):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+
+
+def new_entry_id():
+    return uuid.uuid4().hex
+
+
+def number_entries(entries, first_sl_no):
+    return [dict(entry, SL_NO=first_sl_no + index, ENTRY_ID=new_entry_id()) for index, entry in enumerate(entries)]
+
+
+def apply_append(records, entries):
+    """
+    Appends copies of `entries` to `records`, numbered after the last record. Returns the numbered entries.
+    """
+    added = number_entries(entries, len(records) + 1)
+    records.extend(added)
+    return [dict(entry) for entry in added]
+
+
+def apply_update(records, entry):
+    """
+    Updates, in place, the record with entry["SL_NO"]. Returns False if there is none.
+    """
+    for record in records:
+        if record["SL_NO"] == entry["SL_NO"]:
+            record.update({column: value for column, value in entry.items() if column not in STORAGE_COLUMNS})
+            return True
+    return False
+
+
+def apply_delete(records, sl_no):
+    """
+    Removes, in place, the record with `sl_no` and renumbers the rest. Returns False if there is none.
+    """
+    remaining = [record for record in records if record["SL_NO"] != sl_no]
+    if len(remaining) == len(records):
+        return False
+    # Reindex SL_NO
+    for i, record in enumerate(remaining):
+        record["SL_NO"] = i + 1
+    records[:] = remaining
+    return True
+
+
+def apply_operations(records, operations):
+    """
+    Applies an ordered list of {"op": "update"|"delete"|"insert", "SL_NO": ..., "entry": ...} operations
+    in place. SL_NOs refer to the records as they were before the batch; the SL_NOs are renumbered once
+    at the end. Returns one {"op", "status", "SL_NO"} outcome per operation with status "ok" or "not_found";
+    updated and inserted entries report their final SL_NO.
+    """
+    by_sl_no = {record["SL_NO"]: record for record in records}
+    deleted = set()
+    outcomes = []
+    # (outcome, record) of entries whose final SL_NO is only known after the renumbering
+    placed = []
+    for operation in operations:
+        op = operation["op"]
+        outcome = {"op": op, "status": "ok", "SL_NO": operation.get("SL_NO")}
+        outcomes.append(outcome)
+        if op == "insert":
+            record = {column: operation["entry"].get(column, "") for column in TOPIC_COLUMNS}
+            record["ENTRY_ID"] = new_entry_id()
+            records.append(record)
+            placed.append((outcome, record))
+            continue
+        record = by_sl_no.get(operation["SL_NO"])
+        if record is None or id(record) in deleted:
+            outcome["status"] = "not_found"
+        elif op == "update":
+            record.update({column: value for column, value in operation["entry"].items()
+                           if column not in STORAGE_COLUMNS})
+            placed.append((outcome, record))
+        else:
+            deleted.add(id(record))
+
+    records[:] = [record for record in records if id(record) not in deleted]
+    # Reindex SL_NO once for the whole batch
+    for i, record in enumerate(records):
+        record["SL_NO"] = i + 1
+    for outcome, record in placed:
+        outcome["SL_NO"] = None if id(record) in deleted else record["SL_NO"]
+    return outcomes
+
+
+def snapshot_records(records):
+    # Holds on to the records, so their ids can't be reused while the snapshot is compared
+    return {id(record): (record, dict(record)) for record in records}
+
+
+def entry_changes(snapshot, records):
+    """
+    (before, after) pairs of the snapshotted records that were edited, or removed (after is None), in
+    `records`. Being renumbered alone is not a change.
+    """
+    snapshot = dict(snapshot)
+    changes = []
+    for record in records:
+        _, before = snapshot.pop(id(record), (None, None))
+        if before is not None and any(before.get(column) != record.get(column)
+                                      for column in before.keys() | record.keys() if column != "SL_NO"):
+            changes.append((before, dict(record)))
+    changes.extend((before, None) for _, before in snapshot.values())
+    return changes
+
+
+class InvalidTopicName(ValueError):
+    pass
+
+
+class TopicStorage:
+    """
+    Where the entries of a topic are kept. Records are the dicts returned by load_existing_data,
+    one per paper, keyed by TOPIC_COLUMNS.
+
+    Backends implement `load`, `write` and `list_topics`. The entry-level mutations default to a
+    load -> modify -> write of the whole topic; backends that can change single entries override them.
+    Listeners registered with `add_listener` are called with (user_folder, topic) after every change;
+    those registered with `add_entry_listener` with (user_folder, topic, changes) after entries were edited
+    or deleted, `changes` being the `entry_changes` pairs.
+    """
+    name = None
+    # Whole-topic backends benefit from coalescing writes in a TopicWriteBuffer
+    buffer_writes = True
+
+    def __init__(self):
+        self._listeners = []
+        self._entry_listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def add_entry_listener(self, listener):
+        self._entry_listeners.append(listener)
+
+    def notify_changed(self, user_folder, topic):
+        for listener in self._listeners:
+            try:
+                listener(user_folder, topic)
+            except Exception as e:
+                print(f"Error in topic change listener for {topic}: {e}")
+
+    def snapshot(self, records):
+        # Only worth copying the records if someone listens to entry changes
+        return snapshot_records(records) if self._entry_listeners else None
+
+    def notify_entries_changed(self, user_folder, topic, changes):
+        if not changes:
+            return
+        for listener in self._entry_listeners:
+            try:
+                listener(user_folder, topic, changes)
+            except Exception as e:
+                print(f"Error in entry change listener for {topic}: {e}")
+
+    def load(self, user_folder, topic):
+        raise NotImplementedError
+
+    def write(self, records, user_folder, topic):
+        raise NotImplementedError
+
+    def list_topics(self, user_folder):
+        raise NotImplementedError
+
+    def exists(self, user_folder, topic):
+        return topic in self.list_topics(user_folder)
+
+    def check_names(self, user_folder, topic):
+        """
+        Raises InvalidTopicName if the backend can't keep a topic under these names; None skips a part.
+        """
+
+    def save(self, records, user_folder, topic):
+        """
+        Replaces all entries of the topic.
+        """
+        self.write(records, user_folder, topic)
+        self.notify_changed(user_folder, topic)
+
+    def add_entries(self, user_folder, topic, entries):
+        """
+        Appends entries, numbered after the topic's last entry at the time of the write; any SL_NO they
+        carry is replaced. Returns the numbered entries.
+        """
+        records = self.load(user_folder, topic)
+        added = apply_append(records, entries)
+        self.save(records, user_folder, topic)
+        return added
+
+    def update_entry(self, user_folder, topic, entry):
+        """
+        Updates the fields of the entry with entry["SL_NO"]. Returns False if there is none.
+        """
+        records = self.load(user_folder, topic)
+        snapshot = self.snapshot(records)
+        if not apply_update(records, entry):
+            return False
+        self.save(records, user_folder, topic)
+        if snapshot is not None:
+            self.notify_entries_changed(user_folder, topic, entry_changes(snapshot, records))
+        return True
+
+    def delete_entry(self, user_folder, topic, sl_no):
+        """
+        Deletes the entry with `sl_no` and renumbers the ones after it. Returns False if there is none.
+        """
+        records = self.load(user_folder, topic)
+        snapshot = self.snapshot(records)
+        if not apply_delete(records, sl_no):
+            return False
+        self.save(records, user_folder, topic)
+        if snapshot is not None:
+            self.notify_entries_changed(user_folder, topic, entry_changes(snapshot, records))
+        return True
+
+    def apply_batch(self, user_folder, topic, operations):
+        """
+        Applies `apply_operations` to the topic with a single load and a single write.
+        """
+        records = self.load(user_folder, topic)
+        snapshot = self.snapshot(records)
+        outcomes = apply_operations(records, operations)
+        if any(outcome["status"] == "ok" for outcome in outcomes):
+            self.save(records, user_folder, topic)
+            if snapshot is not None:
+                self.notify_entries_changed(user_folder, topic, entry_changes(snapshot, records))
+        return outcomes
+
+    def pending_exports(self):
+        """
+        (user_folder, topic) pairs changed since their last Excel export, for backends that track it.
+        """
+        return []
+
+    def mark_exported(self, user_folder, topic, revision):
+        pass
+
+    def revision(self, user_folder, topic):
+        """
+        Opaque value that changes whenever the topic changes, or None if the backend can't tell.
+        """
+        return None
+
+    def open_topic(self, user_folder, topic):
+        """
+        Returns (revision, load): the topic's `revision` and a function that loads the topic, for callers
+        that may not need the records once they know the revision.
+        """
+        return self.revision(user_folder, topic), lambda: self.load(user_folder, topic)
+
+
+class TopicParseError(Exception):
+    pass
+
+
+class DriveFileStorage(TopicStorage):
+    """
+    One Drive file per topic in the user's folder, named "{topic}{extension}".
+    Parsed records are cached per Drive revision, so a load only downloads the file when it changed.
+    With a `catalog` (a DriveSync), topics are listed from it instead of from the folder.
+    """
+    extension = None
+    mimetype = None
+    catalog = None
+
+    def serialize(self, records):
+        raise NotImplementedError
+
+    def parse(self, data):
+        raise NotImplementedError
+
+    def find_topic_file(self, service, user_folder, topic):
+        # Cheap metadata-only lookup of the topic file, including its current revision
+        files = service.files().list(q=f"'{user_folder}' in parents and name = '{topic}{self.extension}'",
+                                     spaces='drive', fields=TOPIC_FILE_FIELDS).execute().get('files', [])
+        return files[0] if files else None
+
+    def list_topics(self, user_folder):
+        if self.catalog is not None:
+            return self.catalog.list_topics(user_folder)
+        service = get_user_service(user_folder)
+        files = service.files().list(
+            q=f"'{user_folder}' in parents and mimeType='{self.mimetype}' and trashed = false",
+            spaces='drive',
+            fields='files(id, name)').execute().get('files', [])
+        return [file['name'][:-len(self.extension)] for file in files if file['name'].endswith(self.extension)]
+
+    def exists(self, user_folder, topic):
+        return self.find_topic_file(get_user_service(user_folder), user_folder, topic) is not None
+
+    def _file_revision(self, topic_file):
+        return f"{topic_file['id']}:{file_revision(topic_file)}" if topic_file else "none"
+
+    def revision(self, user_folder, topic):
+        return self._file_revision(self.find_topic_file(get_user_service(user_folder), user_folder, topic))
+
+    def open_topic(self, user_folder, topic):
+        # Looks the file up once, for both the revision and the load
+        service = get_user_service(user_folder)
+        topic_file = self.find_topic_file(service, user_folder, topic)
+        return self._file_revision(topic_file), lambda: self._load_file(service, user_folder, topic, topic_file)
+
+    def load(self, user_folder, topic):
+        service = get_user_service(user_folder)
+        return self._load_file(service, user_folder, topic, self.find_topic_file(service, user_folder, topic))
+
+    def _load_file(self, service, user_folder, topic, topic_file):
+        try:
+            return self._read_file(service, user_folder, topic, topic_file)
+        except TopicParseError as e:
+            print(f"Error loading {self.name} data: {e}")
+            return []
+
+    def read(self, user_folder, topic):
+        """
+        Like `load`, but a file that can't be parsed raises TopicParseError instead of reading as empty.
+        """
+        service = get_user_service(user_folder)
+        return self._read_file(service, user_folder, topic, self.find_topic_file(service, user_folder, topic))
+
+    def _read_file(self, service, user_folder, topic, topic_file):
+        if not topic_file:
+            # If no file exists, return an empty list
+            invalidate_topic(user_folder, topic)
+            return []
+
+        # Only download the file again if it changed since we last parsed it
+        cached_records = get_cached_records(user_folder, topic, topic_file)
+        if cached_records is not None:
+            return cached_records
+
+        # Download the file directly into memory
+        request = service.files().get_media(fileId=topic_file['id'])
+        file_stream = io.BytesIO()
+        with span("topic.download"):
+            downloader = MediaIoBaseDownload(file_stream, request)
+            done = False
+            while not done:
+                status, done = downloader.next_chunk()
+                print(f"Download {int(status.progress() * 100)}%.")
+        drive_bytes.inc("download", amount=file_stream.tell())
+
+        try:
+            with span("topic.parse"):
+                records = self.parse(file_stream.getvalue())
+        except Exception as e:
+            raise TopicParseError(f"{topic}{self.extension}: {e}") from e
+
+        store_records(user_folder, topic, topic_file, records)
+        return [dict(record) for record in records]
+
+    def write(self, records, user_folder, topic):
+        records = normalize_records(records)
+        with span("topic.serialize"):
+            content = self.serialize(records)
+        media_body = MediaIoBaseUpload(io.BytesIO(content), mimetype=self.mimetype)
+
+        # If the file exists, update it; otherwise, create a new one
+        service = get_user_service(user_folder)
+        topic_file = self.find_topic_file(service, user_folder, topic)
+        with span("topic.upload"):
+            if topic_file:
+                topic_file = service.files().update(fileId=topic_file['id'], media_body=media_body,
+                                                    fields=TOPIC_REVISION_FIELDS).execute()
+            else:
+                file_metadata = {'name': f'{topic}{self.extension}', 'parents': [user_folder]}
+                topic_file = service.files().create(body=file_metadata, media_body=media_body,
+                                                    fields=TOPIC_REVISION_FIELDS).execute()
+        drive_bytes.inc("upload", amount=len(content))
+
+        # Write through the topic cache so our own write doesn't trigger a download on the next load
+        store_records(user_folder, topic, topic_file, records)
+
+
+class DriveExcelStorage(DriveFileStorage):
+    name = "drive_xlsx"
+    extension = ".xlsx"
+    mimetype = XLSX_MIMETYPE
+
+    def serialize(self, records):
+        return records_to_excel(records)
+
+    def parse(self, data):
+        return excel_to_records(data)
+
+
+class DriveJsonLinesStorage(DriveFileStorage):
+    name = "drive_jsonl"
+    extension = ".jsonl"
+    mimetype = JSONL_MIMETYPE
+
+    def serialize(self, records):
+        return records_to_jsonl(records)
+
+    def parse(self, data):
+        return jsonl_to_records(data)
+
+
+class LocalJsonLinesStorage(TopicStorage):
+    """
+    Topics as JSON Lines files on local disk, under LOCAL_TOPIC_DIR/{user_folder}/{topic}.jsonl.
+    """
+    name = "local_jsonl"
+
+    def __init__(self, root=LOCAL_TOPIC_DIR):
+        super().__init__()
+        self.root = root
+
+    def check_names(self, user_folder, topic):
+        # Both end up in a path under `root`, so neither may step out of it
+        for part in (user_folder, topic):
+            if part is not None and (part in ("", ".", "..") or "\0" in part or os.sep in part
+                                     or (os.altsep and os.altsep in part)):
+                raise InvalidTopicName(f"Invalid user folder or topic name: {part!r}")
+
+    def _path(self, user_folder, topic):
+        self.check_names(user_folder, topic)
+        return os.path.join(self.root, user_folder, f"{topic}.jsonl")
+
+    def load(self, user_folder, topic):
+        try:
+            with open(self._path(user_folder, topic), 'rb') as topic_file:
+                return jsonl_to_records(topic_file.read())
+        except FileNotFoundError:
+            return []
+
+    def write(self, records, user_folder, topic):
+        path = self._path(user_folder, topic)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a half-written topic
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as topic_file:
+            topic_file.write(records_to_jsonl(normalize_records(records)))
+        os.replace(temp_path, path)
+
+    def list_topics(self, user_folder):
+        self.check_names(user_folder, None)
+        try:
+            names = os.listdir(os.path.join(self.root, user_folder))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".jsonl")] for name in names if name.endswith(".jsonl"))
+
+    def exists(self, user_folder, topic):
+        return os.path.exists(self._path(user_folder, topic))
+
+    def revision(self, user_folder, topic):
+        try:
+            stat = os.stat(self._path(user_folder, topic))
+        except FileNotFoundError:
+            return "none"
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class MongoEntryStorage(TopicStorage):
+    """
+    One MongoDB document per entry, so edits and deletes touch single documents instead of the whole topic.
+    Changed topics are flagged in entry_topics; the ExcelExporter rebuilds their Drive spreadsheet in the
+    background, so edit latency doesn't depend on the size of the topic.
+    """
+    name = "mongo"
+    buffer_writes = False
+
+    def __init__(self, import_from_drive=MONGO_IMPORT_FROM_DRIVE):
+        super().__init__()
+        self.import_from_drive = import_from_drive
+        self.drive_storage = DriveExcelStorage()
+        self._indexes_ready = False
+        self._indexes_lock = threading.Lock()
+        # (user_folder, topic) -> lock held by this process's importer of the topic
+        self._import_locks = {}
+        # (user_folder, topic) -> lock serializing this process's writers of the topic
+        self._topic_locks = {}
+
+    def _ensure_topic(self, user_folder, topic):
+        """
+        Imports the topic's existing spreadsheet, if any, the first time the topic is used. Callers in this
+        or another process wait until the import has finished; a failed import raises and is retried by the
+        next caller, so a topic is never used half-imported.
+        """
+        with self._indexes_lock:
+            if not self._indexes_ready:
+                ensure_entry_indexes()
+                self._indexes_ready = True
+            import_lock = self._import_locks.setdefault((user_folder, topic), threading.Lock())
+        while True:
+            if self._imported(user_folder, topic):
+                return
+            with import_lock:
+                # Another thread of this process may have imported it while we waited for the lock
+                if self._imported(user_folder, topic):
+                    return
+                if claim_entry_topic_import(user_folder, topic, MONGO_IMPORT_LEASE):
+                    try:
+                        records = self.drive_storage.read(user_folder, topic) if self.import_from_drive else []
+                        # Also clears what an earlier, interrupted import left behind
+                        replace_entries(user_folder, topic, normalize_records(records))
+                    except Exception:
+                        release_entry_topic_import(user_folder, topic)
+                        raise
+                    finish_entry_topic_import(user_folder, topic)
+                    return
+            # Another process is importing the topic
+            time.sleep(0.2)
+
+    @contextlib.contextmanager
+    def _topic_lock(self, user_folder, topic):
+        """
+        Holds the topic's write lock in MongoDB, which every process takes before changing the topic's entries.
+        """
+        with self._indexes_lock:
+            local_lock = self._topic_locks.setdefault((user_folder, topic), threading.Lock())
+        # The threads of this process queue here instead of polling MongoDB
+        with local_lock:
+            owner = uuid.uuid4().hex
+            while not lock_entry_topic(user_folder, topic, owner, MONGO_WRITE_LOCK_LEASE):
+                time.sleep(0.05)
+            try:
+                yield
+            finally:
+                unlock_entry_topic(user_folder, topic, owner)
+
+    def _change_topic(self, user_folder, topic, prepare):
+        """
+        Runs one change to the topic's entries. Under the topic's write lock, `prepare()` reads what it needs
+        and returns (write, result), `write` storing the change, or None if there is nothing to store. The
+        write only happens once it has claimed the topic's next revision; if a writer whose lock ran out got
+        there first, `prepare` runs again on a fresh read. Returns `result`.
+        """
+        with self._topic_lock(user_folder, topic):
+            for _ in range(MONGO_WRITE_ATTEMPTS):
+                revision = self.revision(user_folder, topic)
+                write, result = prepare()
+                if write is None:
+                    return result
+                if claim_entry_topic_revision(user_folder, topic, revision):
+                    write()
+                    return result
+        raise RuntimeError(f"Topic {topic} kept changing while it was being written")
+
+    def _imported(self, user_folder, topic):
+        topic_data = get_entry_topic(user_folder, topic)
+        # Topics created before the flag existed were imported when they were claimed
+        return bool(topic_data) and topic_data.get("imported", True)
+
+    def load(self, user_folder, topic):
+        self._ensure_topic(user_folder, topic)
+        return normalize_records(get_entries(user_folder, topic))
+
+    def write(self, records, user_folder, topic):
+        self._ensure_topic(user_folder, topic)
+        records = normalize_records(records)
+        self._change_topic(user_folder, topic,
+                           lambda: (lambda: replace_entries(user_folder, topic, records), None))
+
+    def list_topics(self, user_folder):
+        topics = set(get_entry_topic_names(user_folder))
+        if self.import_from_drive:
+            topics.update(self.drive_storage.list_topics(user_folder))
+        return sorted(topics)
+
+    def exists(self, user_folder, topic):
+        return get_entry_topic(user_folder, topic) is not None
+
+    def add_entries(self, user_folder, topic, entries):
+        self._ensure_topic(user_folder, topic)
+
+        def prepare():
+            added = number_entries(entries, count_entries(user_folder, topic) + 1)
+            return lambda: insert_entries(user_folder, topic, normalize_records(added)), added
+        added = self._change_topic(user_folder, topic, prepare)
+        self.notify_changed(user_folder, topic)
+        return added
+
+    def update_entry(self, user_folder, topic, entry):
+        self._ensure_topic(user_folder, topic)
+        fields = {column: value for column, value in entry.items()
+                  if column in TOPIC_COLUMNS and column not in STORAGE_COLUMNS}
+
+        def prepare():
+            before = get_entry(user_folder, topic, entry["SL_NO"])
+            if before is None:
+                return None, False
+
+            def write():
+                update_entry_fields(user_folder, topic, entry["SL_NO"], fields)
+                # Still under the lock, so entry listeners hear about edits in order
+                [old] = normalize_records([before])
+                if any(old[column] != value for column, value in fields.items()):
+                    self.notify_entries_changed(user_folder, topic, [(old, dict(old, **fields))])
+            return write, True
+        if not self._change_topic(user_folder, topic, prepare):
+            return False
+        self.notify_changed(user_folder, topic)
+        return True
+
+    def delete_entry(self, user_folder, topic, sl_no):
+        self._ensure_topic(user_folder, topic)
+
+        def prepare():
+            before = get_entry(user_folder, topic, sl_no)
+            if before is None:
+                return None, False
+
+            def write():
+                delete_entry_and_renumber(user_folder, topic, sl_no)
+                [old] = normalize_records([before])
+                self.notify_entries_changed(user_folder, topic, [(old, None)])
+            return write, True
+        if not self._change_topic(user_folder, topic, prepare):
+            return False
+        self.notify_changed(user_folder, topic)
+        return True
+
+    def apply_batch(self, user_folder, topic, operations):
+        """
+        Applies `apply_operations` to a copy of the topic and writes only the entries it inserted, changed,
+        renumbered or deleted, in one bulk write.
+        """
+        self._ensure_topic(user_folder, topic)
+
+        def prepare():
+            stored = get_entries_with_ids(user_folder, topic)
+            records = normalize_records(stored)
+            # id(record) -> (doc _id, record as stored)
+            originals = {id(record): (doc["_id"], dict(record)) for record, doc in zip(records, stored)}
+            snapshot = self.snapshot(records)
+            outcomes = apply_operations(records, operations)
+            if not any(outcome["status"] == "ok" for outcome in outcomes):
+                return None, outcomes
+
+            inserts, updates = [], {}
+            for record in records:
+                if id(record) not in originals:
+                    inserts.append({column: record.get(column, "") for column in TOPIC_COLUMNS})
+                    continue
+                entry_id, original = originals.pop(id(record))
+                fields = {column: record[column] for column in TOPIC_COLUMNS
+                          if column in record and record[column] != original.get(column)}
+                if fields:
+                    updates[entry_id] = fields
+            deletes = [entry_id for entry_id, _ in originals.values()]
+
+            def write():
+                apply_entry_changes(user_folder, topic, inserts, updates, deletes)
+                if snapshot is not None:
+                    self.notify_entries_changed(user_folder, topic, entry_changes(snapshot, records))
+            return write, outcomes
+        outcomes = self._change_topic(user_folder, topic, prepare)
+        if any(outcome["status"] == "ok" for outcome in outcomes):
+            self.notify_changed(user_folder, topic)
+        return outcomes
+
+    def pending_exports(self):
+        return get_dirty_entry_topics()
+
+    def mark_exported(self, user_folder, topic, revision):
+        mark_entry_topic_synced(user_folder, topic, revision)
+
+    def revision(self, user_folder, topic):
+        topic_data = get_entry_topic(user_folder, topic)
+        return topic_data["revision"] if topic_data else None
+
+
+STORAGE_BACKENDS = {
+    DriveExcelStorage.name: DriveExcelStorage,
+    DriveJsonLinesStorage.name: DriveJsonLinesStorage,
+    LocalJsonLinesStorage.name: LocalJsonLinesStorage,
+    MongoEntryStorage.name: MongoEntryStorage,
+}
+
+
+def create_topic_storage(name=TOPIC_STORAGE):
+    if name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown TOPIC_STORAGE {name}, expected one of {list(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[name]()
+
+
+def drive_file_storage(storage):
+    """
+    The Drive file storage the topics of `storage` are listed from, or None if it doesn't use Drive.
+    """
+    if isinstance(storage, DriveFileStorage):
+        return storage
+    if isinstance(storage, MongoEntryStorage) and storage.import_from_drive:
+        return storage.drive_storage
+    return None
+
+
+class ExcelExporter:
+    """
+    Keeps the Drive .xlsx of each topic as an export of the primary storage.
+    `schedule` (re)starts a debounce timer for the topic, so a burst of edits produces one export.
+    """
+
+    def __init__(self, storage, debounce=EXCEL_EXPORT_DEBOUNCE):
+        self.storage = storage
+        self.debounce = debounce
+        self.excel_storage = DriveExcelStorage()
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        # Nothing to export when the primary storage already is the Drive spreadsheet
+        return not isinstance(self.storage, DriveExcelStorage)
+
+    def schedule(self, user_folder, topic):
+        if not self.enabled or self.debounce <= 0:
+            return
+        timer = threading.Timer(self.debounce, self._export_scheduled, args=(user_folder, topic))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get((user_folder, topic))
+            if previous:
+                previous.cancel()
+            self._timers[(user_folder, topic)] = timer
+        timer.start()
+
+    def export(self, user_folder, topic):
+        """
+        Writes the current records of the topic to its Drive .xlsx right away.
+        """
+        revision = self.storage.revision(user_folder, topic)
+        self.excel_storage.save(self.storage.load(user_folder, topic), user_folder, topic)
+        self.storage.mark_exported(user_folder, topic, revision)
+
+    def resume(self):
+        """
+        Schedules the exports the storage still has pending, e.g. from before a restart.
+        """
+        if not self.enabled:
+            return
+        for user_folder, topic in self.storage.pending_exports():
+            self.schedule(user_folder, topic)
+
+    def flush(self):
+        """
+        Runs every pending export now, e.g. on shutdown.
+        """
+        with self._lock:
+            pending = list(self._timers)
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        for user_folder, topic in pending:
+            self._run_export(user_folder, topic)
+
+    def _export_scheduled(self, user_folder, topic):
+        with self._lock:
+            if self._timers.get((user_folder, topic)) is not threading.current_thread():
+                return  # Rescheduled or flushed in the meantime
+            del self._timers[(user_folder, topic)]
+        self._run_export(user_folder, topic)
+
+    def _run_export(self, user_folder, topic):
+        try:
+            self.export(user_folder, topic)
+        except Exception as e:
+            print(f"Error exporting {topic} to Excel: {e}")
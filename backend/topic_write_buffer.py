@@ -0,0 +1,247 @@
+import os
+import threading
+import time
+import uuid
+
+from topic_storage import TopicStorage, apply_append, apply_delete, apply_operations, apply_update, entry_changes
+
+# Buffered changes to a topic are written to its storage at most once per this many seconds; 0 disables buffering
+TOPIC_WRITE_INTERVAL = float(os.environ.get("TOPIC_WRITE_INTERVAL", "2"))
+
+
+class _TopicBuffer:
+    def __init__(self):
+        # Serializes the mutations of the topic, in the order they arrive
+        self.lock = threading.Lock()
+        # Serializes the flushes, which run outside `lock` so mutations don't wait on Drive
+        self.flush_lock = threading.Lock()
+        self.records = None
+        self.pending_writes = 0
+        self.generation = 0
+        self.timer = None
+
+
+class TopicWriteBuffer(TopicStorage):
+    """
+    Write-behind front of a whole-topic storage.
+
+    Mutations of a topic are applied one at a time to an in-memory copy of its records, so concurrent
+    edits no longer overwrite each other, and reads see them right away. The copy is written to the
+    underlying storage at most once per `interval`, when `flush` is called, and on shutdown.
+    """
+
+    def __init__(self, storage, interval=TOPIC_WRITE_INTERVAL):
+        super().__init__()
+        self.storage = storage
+        self.interval = interval
+        self.name = storage.name
+        # Generations restart with the process, so revisions of buffered topics carry a per-process id
+        self._instance_id = uuid.uuid4().hex[:8]
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._flushes = 0
+        self._writes = 0
+        self._errors = 0
+        self._total_flush = 0.0
+        # writes per flush -> number of flushes
+        self._coalesced = {}
+
+    def add_listener(self, listener):
+        # Listeners hear about a change once it has reached the underlying storage
+        self.storage.add_listener(listener)
+
+    def _buffer(self, user_folder, topic):
+        with self._lock:
+            return self._buffers.setdefault((user_folder, topic), _TopicBuffer())
+
+    def _buffered_records(self, user_folder, topic):
+        buffer = self._buffers.get((user_folder, topic))
+        if buffer is None:
+            return None
+        with buffer.lock:
+            return None if buffer.records is None else [dict(record) for record in buffer.records]
+
+    def _mutate(self, user_folder, topic, apply, edits_entries=False):
+        """
+        Applies `apply(records)` to the buffered records; a False result means nothing changed. With
+        `edits_entries`, the entries it edited or deleted are passed to the entry listeners.
+        """
+        buffer = self._buffer(user_folder, topic)
+        with buffer.lock:
+            if buffer.records is None:
+                buffer.records = self.storage.load(user_folder, topic)
+            snapshot = self.snapshot(buffer.records) if edits_entries else None
+            result = apply(buffer.records)
+            if result is False:
+                return False
+            buffer.pending_writes += 1
+            buffer.generation += 1
+            # Not restarted by later writes, so a busy topic is still written every `interval`
+            self._schedule_flush(buffer, user_folder, topic)
+            if snapshot is not None:
+                # Right away rather than at the flush, and under the lock so they hear edits in order
+                self.notify_entries_changed(user_folder, topic, entry_changes(snapshot, buffer.records))
+            return True
+
+    def load(self, user_folder, topic):
+        records = self._buffered_records(user_folder, topic)
+        return records if records is not None else self.storage.load(user_folder, topic)
+
+    def write(self, records, user_folder, topic):
+        records = [dict(record) for record in records]
+
+        def replace(buffered):
+            buffered[:] = records
+        self._mutate(user_folder, topic, replace)
+
+    def save(self, records, user_folder, topic):
+        self.write(records, user_folder, topic)
+
+    def add_entries(self, user_folder, topic, entries):
+        added = []
+        # Numbered under the topic's lock, after whatever the earlier mutations left
+        self._mutate(user_folder, topic, lambda records: added.extend(apply_append(records, entries)))
+        return added
+
+    def update_entry(self, user_folder, topic, entry):
+        entry = dict(entry)
+        return self._mutate(user_folder, topic, lambda records: apply_update(records, entry), edits_entries=True)
+
+    def delete_entry(self, user_folder, topic, sl_no):
+        return self._mutate(user_folder, topic, lambda records: apply_delete(records, sl_no), edits_entries=True)
+
+    def apply_batch(self, user_folder, topic, operations):
+        outcomes = []
+
+        def apply(records):
+            outcomes.extend(apply_operations(records, operations))
+            return any(outcome["status"] == "ok" for outcome in outcomes)
+        self._mutate(user_folder, topic, apply, edits_entries=True)
+        return outcomes
+
+    def list_topics(self, user_folder):
+        topics = set(self.storage.list_topics(user_folder))
+        with self._lock:
+            buffered = [topic for (folder, topic), buffer in self._buffers.items()
+                        if folder == user_folder and buffer.records is not None]
+        topics.update(buffered)
+        return sorted(topics)
+
+    def check_names(self, user_folder, topic):
+        self.storage.check_names(user_folder, topic)
+
+    def exists(self, user_folder, topic):
+        return self._buffered_records(user_folder, topic) is not None or self.storage.exists(user_folder, topic)
+
+    def pending_exports(self):
+        return self.storage.pending_exports()
+
+    def mark_exported(self, user_folder, topic, revision):
+        self.storage.mark_exported(user_folder, topic, revision)
+
+    def revision(self, user_folder, topic):
+        buffer = self._buffers.get((user_folder, topic))
+        if buffer is not None:
+            with buffer.lock:
+                if buffer.records is not None:
+                    return f"{self._instance_id}:{buffer.generation}"
+        return self.storage.revision(user_folder, topic)
+
+    def open_topic(self, user_folder, topic):
+        buffer = self._buffers.get((user_folder, topic))
+        if buffer is not None:
+            with buffer.lock:
+                if buffer.records is not None:
+                    # Copied under the lock, so the records are those of the revision
+                    records = [dict(record) for record in buffer.records]
+                    return f"{self._instance_id}:{buffer.generation}", lambda: records
+        return self.storage.open_topic(user_folder, topic)
+
+    def flush(self, user_folder, topic):
+        """
+        Writes the buffered changes of a topic to the underlying storage now.
+        """
+        buffer = self._buffers.get((user_folder, topic))
+        if buffer is None:
+            return
+        with buffer.flush_lock:
+            with buffer.lock:
+                if buffer.timer:
+                    buffer.timer.cancel()
+                    buffer.timer = None
+                if not buffer.pending_writes:
+                    return
+                records = [dict(record) for record in buffer.records]
+                writes, generation = buffer.pending_writes, buffer.generation
+                buffer.pending_writes = 0
+
+            started = time.monotonic()
+            try:
+                self.storage.save(records, user_folder, topic)
+            except Exception:
+                with buffer.lock:
+                    # Keep the changes and try again later
+                    buffer.pending_writes += writes
+                    self._schedule_flush(buffer, user_folder, topic)
+                with self._lock:
+                    self._errors += 1
+                raise
+
+            with buffer.lock:
+                if buffer.generation == generation:
+                    # Nothing changed while writing: later reads can go to the storage again
+                    buffer.records = None
+            with self._lock:
+                self._flushes += 1
+                self._writes += writes
+                self._total_flush += time.monotonic() - started
+                self._coalesced[writes] = self._coalesced.get(writes, 0) + 1
+
+    def flush_all(self):
+        """
+        Writes every topic with buffered changes, e.g. on shutdown.
+        """
+        with self._lock:
+            keys = list(self._buffers)
+        for user_folder, topic in keys:
+            try:
+                self.flush(user_folder, topic)
+            except Exception as e:
+                print(f"Error writing buffered changes of {topic}: {e}")
+
+    def _schedule_flush(self, buffer, user_folder, topic):
+        # Called with buffer.lock held
+        if buffer.timer is None:
+            buffer.timer = threading.Timer(self.interval, self._flush_scheduled, args=(user_folder, topic))
+            buffer.timer.daemon = True
+            buffer.timer.start()
+
+    def _flush_scheduled(self, user_folder, topic):
+        buffer = self._buffers.get((user_folder, topic))
+        with buffer.lock:
+            if buffer.timer is not threading.current_thread():
+                return  # Flushed in the meantime
+            buffer.timer = None
+        try:
+            self.flush(user_folder, topic)
+        except Exception as e:
+            print(f"Error writing buffered changes of {topic}: {e}")
+
+    def stats(self):
+        with self._lock:
+            buffers = list(self._buffers.values())
+            flushes = self._flushes
+            writes = self._writes
+            stats = {
+                "interval_s": self.interval,
+                "flushes": flushes,
+                "writes": writes,
+                "coalesced_writes": writes - flushes,
+                "errors": self._errors,
+                "writes_per_flush_histogram": dict(sorted(self._coalesced.items())),
+                "avg_writes_per_flush": writes / flushes if flushes else 0.0,
+                "avg_flush_ms": self._total_flush / flushes * 1000 if flushes else 0.0,
+            }
+        stats["pending_topics"] = sum(1 for buffer in buffers if buffer.pending_writes)
+        stats["pending_writes"] = sum(buffer.pending_writes for buffer in buffers)
+        return stats
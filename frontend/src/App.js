@@ -107,7 +107,8 @@ const App = () => {
                 },
                 params: {user_folder: userFolder, topic: topic},
             });
-            setData([...data, ...response.data]);
+            const added = response.data.filter(result => result.status === 'added').map(result => result.entry);
+            setData([...data, ...added]);
             toast.success('PDFs uploaded and parsed successfully!');
         } catch (error) {
             toast.error('An error occurred while processing the PDFs.');
@@ -125,7 +126,8 @@ const App = () => {
                     topic: topic
                 }
             });
-            setData([...data, ...response.data]);
+            const added = response.data.filter(result => result.status === 'added').map(result => result.entry);
+            setData([...data, ...added]);
             toast.success('DOIs fetched and parsed successfully!');
         } catch (error) {
             toast.error('An error occurred while fetching data for the DOIs.');